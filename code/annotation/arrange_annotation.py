@@ -2,6 +2,10 @@ import xml.etree.ElementTree as ET
 import re
 import json
 import argparse
+import glob
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 
 def parse_arguments():
@@ -9,34 +13,89 @@ def parse_arguments():
     parser.add_argument('--video_id')
     parser.add_argument('--anno_id')
     parser.add_argument('--team_id')
+    parser.add_argument('--batch', action='store_true', help="Process every annotator XML of both Left and Right (ignores --anno_id and --team_id)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of XML files processed in parallel in batch mode")
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
     video_ids = [str(video_id) for video_id in args.video_id.split(",")]
+
+    if args.batch:
+        arrange_annotation_batch(video_ids, args.workers)
+        return
+
     anno_ids = [str(anno_id) for anno_id in args.anno_id.split(",")]
     team_id = args.team_id
 
     for video_id in video_ids:
+        # TXTファイルの読み込み (動画ごとに一度)
+        txt_file = f'raw/video/videolist_{video_id}.txt'
+        videos = parse_video_list(txt_file)
+
         for anno_id in anno_ids:
             # XMLファイルの読み込み
             xml_file = f'raw/annotation/{video_id}_{team_id}/{video_id}_{anno_id}_{team_id}.xml'
 
-            # TXTファイルの読み込み
-            txt_file = f'raw/video/videolist_{video_id}.txt'
-
             # output file
             output_file = f'raw/annotation/{video_id}_{team_id}/{video_id}_{anno_id}_{team_id}.json'
 
-            arrange_annotation(xml_file, txt_file, output_file)
+            arrange_annotation(xml_file, txt_file, output_file, videos)
 
 
-def arrange_annotation(xml_file, txt_file, output_file):
+def arrange_annotation_batch(video_ids, workers=1):
+    """
+    Arrange every annotator XML of both teams of the given videos.
 
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
+    Each video list is parsed once. The XML files
+    raw/annotation/{video_id}_{Left|Right}/{video_id}_{anno_id}_{Left|Right}.xml
+    are processed in a process pool, and each writes the JSON file next to it.
+    A failed file is reported and the others still run; the script then exits
+    with status 1.
 
+    Args:
+        video_ids (list of str): Video identifiers to process.
+        workers (int): Number of XML files processed in parallel.
+    """
+    tasks = []
+    for video_id in video_ids:
+        txt_file = f'raw/video/videolist_{video_id}.txt'
+        videos = parse_video_list(txt_file)
+        for team_id in ("Left", "Right"):
+            xml_files = sorted(glob.glob(f'raw/annotation/{video_id}_{team_id}/{video_id}_*_{team_id}.xml'))
+            if not xml_files:
+                print(f"No annotation XML found for {video_id}_{team_id}")
+            for xml_file in xml_files:
+                output_file = f"{os.path.splitext(xml_file)[0]}.json"
+                tasks.append((xml_file, txt_file, output_file, videos))
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [(task[0], executor.submit(arrange_annotation, *task)) for task in tasks]
+        for xml_file, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to arrange {xml_file}: {type(e).__name__}: {e}")
+                failed.append(xml_file)
+
+    print(f"Arranged {len(tasks) - len(failed)} of {len(tasks)} annotation files")
+    if failed:
+        raise SystemExit(1)
+
+
+def parse_video_list(txt_file):
+    """
+    Read the videos of a video list file.
+
+    Args:
+        txt_file (str): Path to videolist_{id}.txt.
+
+    Returns:
+        dict: video_file -> (game_id, start_time, end_time) in seconds, in list order.
+            Lines that do not name a time range are skipped.
+    """
     with open(txt_file, "r") as f:
         video_files = [line.strip() for line in f.readlines()]
 
@@ -47,55 +106,93 @@ def arrange_annotation(xml_file, txt_file, output_file):
         print(game_id, start_time, end_time)
         if start_time is not None and end_time is not None:
             videos[video_file] = (game_id, start_time, end_time)
+    return videos
+
+
+def arrange_annotation(xml_file, txt_file, output_file, videos=None):
+    """
+    Convert the instances of an annotator XML to per-video label intervals and save them as JSON.
+
+    Args:
+        xml_file (str): Annotator XML file.
+        txt_file (str): Video list of the match; only read if videos is not given.
+        output_file (str): Output JSON file.
+        videos (dict): Parsed video list (see parse_video_list).
+    """
+    if videos is None:
+        videos = parse_video_list(txt_file)
+
+    annotations_data = arrange_instances(xml_file, videos)
+
+    # JSONファイルの書き込み
+    with open(output_file, "w") as f:
+        json.dump(annotations_data, f, indent=2)
+
+    print(f"JSON file saved to {output_file}")
+
+
+def arrange_instances(xml_file, videos):
+    """
+    Convert the instances of an annotator XML to per-video label intervals.
+
+    Args:
+        xml_file (str): Annotator XML file.
+        videos (dict): Parsed video list (see parse_video_list).
+
+    Returns:
+        list of dict: One entry per video with game_id, start_video, end_video (ms)
+            and the annotations (label, start, end in ms), as saved by arrange_annotation.
+    """
+    tree = ET.parse(xml_file)
+    root = tree.getroot()
 
     # XMLのラベル解析
     annotations_data = []
-    instances = root.find("ALL_INSTANCES").findall("instance")
+    instances = [
+        (instance.find("code").text, float(instance.find("start").text))
+        for instance in root.find("ALL_INSTANCES").findall("instance")
+    ]
 
-    for i, instance in enumerate(instances):
-        annotation_id = instance.find("ID").text
-        start = float(instance.find("start").text)
-        code = instance.find("code").text
+    # 全インスタンスの開始時刻を一度に動画と動画内オフセットに変換
+    video_names = list(videos)
+    video_indices, offsets = find_videos_and_offsets([start for _, start in instances], videos)
 
+    # start_video -> JSON上のエントリ
+    annotations_by_start = {}
+
+    for i, (code, start) in enumerate(instances):
         if code == "End":
             continue
 
-        video, offset, video_start_time = find_video_and_offset(start, videos)
-        if video:
-            offset_time = video_start_time + offset
+        if video_indices[i] >= 0:
+            video = video_names[video_indices[i]]
+            video_start_time = videos[video][1]
+            offset_time = video_start_time + offsets[i]
             start_formatted = format_time(offset_time)
 
             # Determine the end time
-            if i + 1 < len(instances):
-                next_start = float(instances[i + 1].find("start").text)
-                next_video, next_offset, next_video_start_time = find_video_and_offset(next_start, videos)
-
-                if video == next_video:
-                    end_formatted = format_time(next_video_start_time + next_offset)
-                else:
-                    end_formatted = format_time(videos[video][2])
+            if i + 1 < len(instances) and video_indices[i + 1] == video_indices[i]:
+                end_formatted = format_time(video_start_time + offsets[i + 1])
             else:
                 end_formatted = format_time(videos[video][2])
 
             # Add to JSON structure
-            existing_video = next((item for item in annotations_data if item["start_video"] == format_time(videos[video][1])), None)
+            start_video = format_time(videos[video][1])
+            existing_video = annotations_by_start.get(start_video)
             if existing_video:
                 existing_video["annotations"].append({"label": code, "start": start_formatted, "end": end_formatted})
             else:
-                annotations_data.append({
+                annotations_by_start[start_video] = {
                     "game_id": videos[video][0],
-                    "start_video": format_time(videos[video][1]),
+                    "start_video": start_video,
                     "end_video": format_time(videos[video][2]),
                     "annotations": [
                         {"label": code, "start": start_formatted, "end": end_formatted}
                     ]
-                })
+                }
+                annotations_data.append(annotations_by_start[start_video])
 
-    # JSONファイルの書き込み
-    with open(output_file, "w") as f:
-        json.dump(annotations_data, f, indent=2)
-
-    print(f"JSON file saved to {output_file}")
+    return annotations_data
 
 
 def parse_time_range(filename):
@@ -116,16 +213,42 @@ def format_time(seconds):
     return int(m_seconds)
 
 
-def find_video_and_offset(annotation_start_in_all_video, videos):
-    elapsed_time = 0
-    for video in videos:
-        game_id, start_time, end_time = videos[video]
-        video_duration = end_time - start_time
-        if elapsed_time <= annotation_start_in_all_video < elapsed_time + video_duration:
-            annotation_start_in_each_video = annotation_start_in_all_video - elapsed_time
-            return video, annotation_start_in_each_video, start_time
-        elapsed_time += video_duration
-    return None, None, None
+def find_videos_and_offsets(annotation_starts_in_all_video, videos):
+    """
+    Find the video and the offset within it of each time on the concatenated timeline of the videos.
+
+    The videos are laid end to end in order, each lasting end_time - start_time
+    seconds. A time belongs to the video whose [elapsed, elapsed + duration)
+    contains it; the videos are found with one binary search over the
+    cumulative durations.
+
+    Args:
+        annotation_starts_in_all_video (list of float): Times on the concatenated timeline (s).
+        videos (dict): video_file -> (game_id, start_time, end_time), in playback order.
+
+    Returns:
+        tuple: (index of the video in videos or -1 if the time is outside every video,
+            offset within the video (s) or None).
+    """
+    durations = [end_time - start_time for _, start_time, end_time in videos.values()]
+    if any(duration < 0 for duration in durations):
+        raise ValueError("Video list contains a video that ends before it starts")
+    elapsed_times = [0]
+    for duration in durations:
+        elapsed_times.append(elapsed_times[-1] + duration)
+
+    # 同じ経過時間の動画が並ぶ場合 (長さ0の動画) は最後の動画を選ぶ
+    indices = np.searchsorted(elapsed_times, annotation_starts_in_all_video, side="right") - 1
+    video_indices = []
+    offsets = []
+    for annotation_start_in_all_video, index in zip(annotation_starts_in_all_video, indices.tolist()):
+        if 0 <= index < len(durations) and annotation_start_in_all_video < elapsed_times[index + 1]:
+            video_indices.append(index)
+            offsets.append(annotation_start_in_all_video - elapsed_times[index])
+        else:
+            video_indices.append(-1)
+            offsets.append(None)
+    return video_indices, offsets
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+"""
+This script builds the combined per-clip label tables straight from the annotator XML files:
+raw/annotation/{video_id}_{Left|Right}/{video_id}_{anno_id}_{Left|Right}.xml
+-> interim/{game_id}/{game_id}_{start}-{end}_annotation_combined.csv
+
+It gives the same tables as running arrange_annotation.py, convert_annotation_to_csv.py
+and combine_right_and_left_annotation.py one after another, but keeps the
+intermediate annotations in memory. The per-annotator JSON files and the
+per-team CSV files are only written when asked for.
+
+Usage:
+    python annotation/build_combined_annotation.py --video_id <video_id>
+
+Example:
+    python annotation/build_combined_annotation.py --video_id 117093,128058 --save_json
+
+Arguments:
+    --video_id: Comma-separated video (match) identifiers to process.
+    --save_json: Also write the per-annotator JSON files of arrange_annotation.py.
+    --save_csv: Also write the per-team CSV files of convert_annotation_to_csv.py.
+"""
+
+import argparse
+import glob
+import json
+import os
+from pathlib import Path
+from arrange_annotation import parse_video_list, arrange_instances
+from convert_annotation_to_csv import generate_csv_from_entries, sanitize_filename
+from label_index import build_label_indexes
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Build the combined annotation CSV files directly from the annotator XML files.")
+    parser.add_argument('--video_id', required=True, help="Comma-separated video identifiers to process")
+    parser.add_argument('--save_json', action='store_true', help="Also write the per-annotator JSON files")
+    parser.add_argument('--save_csv', action='store_true', help="Also write the per-team annotation CSV files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    video_ids = [str(video_id) for video_id in args.video_id.split(",")]
+
+    for video_id in video_ids:
+        build_combined_annotation(video_id, args.save_json, args.save_csv)
+
+
+def build_combined_annotation(video_id, save_json=False, save_csv=False):
+    """
+    Build the combined annotation CSV of every clip of a video annotated for both teams.
+
+    Args:
+        video_id (str): The video (match) identifier.
+        save_json (bool): Also write {video_id}_{anno_id}_{team_id}.json next to each XML file.
+        save_csv (bool): Also write the {game_id}_{start}-{end}_annotation.csv files of each team.
+    """
+    videos = parse_video_list(f'raw/video/videolist_{video_id}.txt')
+
+    entries = {}
+    for team_id in ("Left", "Right"):
+        team_dir = f'raw/annotation/{video_id}_{team_id}'
+        xml_files = sorted(glob.glob(f'{team_dir}/{video_id}_*_{team_id}.xml'))
+        if not xml_files:
+            print(f"No annotation XML found for {video_id}_{team_id}")
+
+        entries[team_id] = []
+        for xml_file in xml_files:
+            annotations_data = arrange_instances(xml_file, videos)
+            if save_json:
+                output_file = f"{os.path.splitext(xml_file)[0]}.json"
+                with open(output_file, "w") as f:
+                    json.dump(annotations_data, f, indent=2)
+                print(f"JSON file saved to {output_file}")
+            entries[team_id].extend(annotations_data)
+
+        if save_csv:
+            generate_csv_from_entries(entries[team_id], team_dir)
+
+    # 片方のチームにしかないクリップは combine と同じくスキップ
+    clips = [{(entry["game_id"], entry["start_video"], entry["end_video"]) for entry in entries[team_id]}
+             for team_id in ("Left", "Right")]
+    for game_id, start_video, end_video in sorted(clips[0] ^ clips[1]):
+        print(f"Annotation of {game_id}_{sanitize_filename(start_video)}-{sanitize_filename(end_video)} "
+              f"found for one team only. Skipping.")
+
+    indexes = build_label_indexes(entries["Left"], entries["Right"])
+    for (game_id, start_video, end_video), index in indexes.items():
+        output_dir = Path(f"interim/{game_id}")
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        output_file = output_dir / f"{game_id}_{sanitize_filename(start_video)}-{sanitize_filename(end_video)}_annotation_combined.csv"
+        index.to_frame().to_csv(output_file, index=False)
+        print(f"Combined CSV saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,15 @@ import json
 import csv
 from collections import defaultdict
 import argparse
+import numpy as np
+
+
+# 定義済み列名の順序
+FIXED_LABELS = ["Build up", "Progression", "Final third", "Counter-attack", "High press", "Mid block", "Low block", "Counter-press", "Recovery"]
+
+# Interval of the output rows (ms) and number of annotators the counts are divided by
+LABEL_STEP = 200
+NUM_ANNOTATORS = 4
 
 
 def parse_arguments():
@@ -30,40 +39,35 @@ def main():
 
 
 def generate_csv(json_files, output_dir):
+    entries = []
+    for json_file in json_files:
+        with open(json_file, "r") as f:
+            entries.extend(json.load(f))
+
+    generate_csv_from_entries(entries, output_dir)
+
+
+def generate_csv_from_entries(entries, output_dir):
+    """
+    Write the soft labels of each video to {game_id}_{start}-{end}_annotation.csv.
+
+    Args:
+        entries (list of dict): arrange_annotation entries of all annotators of one team.
+        output_dir (str): Output directory.
+    """
     video_data = defaultdict(list)
 
-    # 定義済み列名の順序
-    fixed_labels = ["Build up", "Progression", "Final third", "Counter-attack", "High press", "Mid block", "Low block", "Counter-press", "Recovery"]
-    fieldnames = ["match_time"] + fixed_labels
+    fieldnames = ["match_time"] + FIXED_LABELS
 
     # Read and group annotations by video
-    for json_file in json_files:
-        with open(json_file, "r") as f:
-            data = json.load(f)
-            for entry in data:
-                key = (entry["game_id"], entry["start_video"], entry["end_video"])
-                video_data[key].append(entry["annotations"])
+    for entry in entries:
+        key = (entry["game_id"], entry["start_video"], entry["end_video"])
+        video_data[key].append(entry["annotations"])
 
     # Process each video
     for (game_id, start_video, end_video), annotations_list in video_data.items():
-        duration = end_video - start_video
-
-        # Initialize a dictionary for each second
-        probabilities = {t: defaultdict(float) for t in range(start_video, end_video)}
-
-        # Aggregate annotations
-        for annotations in annotations_list:
-            for annotation in annotations:
-                label = annotation["label"]
-                label_start = max(start_video, annotation["start"])
-                label_end = min(end_video, annotation["end"])
-                for t in range(label_start, label_end):
-                    probabilities[t][label] += 1
-
-        # Normalize probabilities
-        for t in probabilities:
-            for label in probabilities[t]:
-                probabilities[t][label] /= 4
+        intervals = [annotation for annotations in annotations_list for annotation in annotations]
+        times, probabilities = rasterize_labels(intervals, start_video, end_video)
 
         # Write to CSV
         sanitized_start_video = sanitize_filename(start_video)
@@ -71,19 +75,57 @@ def generate_csv(json_files, output_dir):
         output_file = f"{output_dir}/{game_id}_{sanitized_start_video}-{sanitized_end_video}_annotation.csv"
 
         with open(output_file, "w", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.writer(csvfile)
 
-            writer.writeheader()
-            for t in range(start_video, end_video):
-                if t % 200 != 0:
-                    continue
-                row = {label: probabilities[t].get(label, 0.0) for label in fixed_labels}
-                row["match_time"] = t
-                writer.writerow(row)
+            writer.writerow(fieldnames)
+            writer.writerows([t] + row for t, row in zip(times.tolist(), probabilities.tolist()))
 
         print(f"CSV file saved: {output_file}")
 
 
+def rasterize_labels(annotations, start_video, end_video, labels=FIXED_LABELS, step=LABEL_STEP, num_annotators=NUM_ANNOTATORS):
+    """
+    Compute the soft labels of a video on its output grid from the annotation intervals.
+
+    The grid is every match_time t in [start_video, end_video) with t % step == 0.
+    The value of a label at t is the number of its intervals [start, end) that
+    contain t, over all annotators, divided by num_annotators. Each interval adds
+    +1 at its first grid point and -1 after its last one in a difference array,
+    and a cumulative sum gives the counts.
+
+    Args:
+        annotations (list of dict): Intervals with "label", "start" and "end" (ms) of all annotators.
+        start_video (int): Start of the video (ms).
+        end_video (int): End of the video (ms).
+        labels (list of str): Output labels; intervals of other labels are ignored.
+        step (int): Interval of the grid (ms).
+        num_annotators (int): The counts are divided by this.
+
+    Returns:
+        tuple: (times (grid points,), probabilities (grid points, labels)).
+    """
+    first_time = -(-start_video // step) * step
+    times = np.arange(first_time, end_video, step, dtype=np.int64)
+
+    label_index = {label: i for i, label in enumerate(labels)}
+    selected = [annotation for annotation in annotations if annotation["label"] in label_index]
+    label_ids = np.array([label_index[annotation["label"]] for annotation in selected], dtype=np.int64)
+    starts = np.array([annotation["start"] for annotation in selected], dtype=np.int64)
+    ends = np.array([annotation["end"] for annotation in selected], dtype=np.int64)
+
+    # 最初と最後の格子点 (区間 [start, end) に含まれる範囲)
+    first = np.searchsorted(times, np.maximum(starts, start_video), side="left")
+    last = np.searchsorted(times, np.minimum(ends, end_video), side="left")
+    nonempty = first < last
+
+    counts = np.zeros((len(labels), len(times) + 1), dtype=np.int64)
+    np.add.at(counts, (label_ids[nonempty], first[nonempty]), 1)
+    np.add.at(counts, (label_ids[nonempty], last[nonempty]), -1)
+    counts = np.cumsum(counts[:, :-1], axis=1)
+
+    return times, (counts / num_annotators).T
+
+
 def sanitize_filename(time):
     time = time / 1000
     minutes = int(time / 60)
@@ -0,0 +1,150 @@
+"""
+Interval index over the annotation of a clip, queried for soft labels at any times.
+
+The index is built from the entries written by arrange_annotation.py (one list
+per annotator JSON file) for the Left and Right teams. It keeps the label
+intervals of all annotators and answers a batch of query times with the soft
+labels convert_annotation_to_csv.py would compute at those times, in the column
+order of the combined annotation CSV ("Build up 1", ..., "Recovery 2").
+
+Usage:
+    from label_index import read_entries, build_label_indexes
+
+    left = read_entries([f"raw/annotation/{video_id}_Left/{video_id}_{i}_Left.json" for i in range(1, 5)])
+    right = read_entries([f"raw/annotation/{video_id}_Right/{video_id}_{i}_Right.json" for i in range(1, 5)])
+    indexes = build_label_indexes(left, right)
+    labels = indexes[(game_id, start_video, end_video)].query(match_times)
+"""
+
+import json
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from convert_annotation_to_csv import FIXED_LABELS, LABEL_STEP, NUM_ANNOTATORS
+
+
+# Suffix of the Left and Right columns in the combined annotation CSV
+SIDE_SUFFIXES = (" 1", " 2")
+
+
+class LabelIndex:
+    """
+    Soft labels of one clip as sorted interval endpoints.
+
+    Intervals are clipped to [start_video, end_video). The number of intervals
+    of a column that contain t is the number of starts <= t minus the number of
+    ends <= t. Starts and ends of all columns are kept in two sorted arrays keyed
+    by column * span + (time - start_video), so one searchsorted per array
+    answers every (time, column) pair.
+    """
+
+    def __init__(self, start_video, end_video, intervals, columns, num_annotators=NUM_ANNOTATORS):
+        """
+        Args:
+            start_video (int): Start of the clip (ms).
+            end_video (int): End of the clip (ms).
+            intervals (list of tuple): (column index, start, end) of every interval, in ms.
+            columns (list of str): Output column names.
+            num_annotators (int): The counts are divided by this.
+        """
+        self.start_video = start_video
+        self.end_video = end_video
+        self.columns = list(columns)
+        self.num_annotators = num_annotators
+        self.span = end_video - start_video + 1
+
+        column_ids = np.array([interval[0] for interval in intervals], dtype=np.int64)
+        starts = np.maximum(np.array([interval[1] for interval in intervals], dtype=np.int64), start_video)
+        ends = np.minimum(np.array([interval[2] for interval in intervals], dtype=np.int64), end_video)
+        nonempty = starts < ends
+
+        base = column_ids[nonempty] * self.span - start_video
+        self.start_keys = np.sort(base + starts[nonempty])
+        self.end_keys = np.sort(base + ends[nonempty])
+
+    def query(self, times):
+        """
+        Return the soft labels at the given times.
+
+        Args:
+            times (array-like): Query times (ms), in any order.
+
+        Returns:
+            numpy.ndarray: Shape (len(times), len(columns)), float64. Rows of times
+                outside [start_video, end_video) are NaN.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        keys = np.arange(len(self.columns)) * self.span + (times[:, None] - self.start_video)
+        counts = (np.searchsorted(self.start_keys, keys, side="right")
+                  - np.searchsorted(self.end_keys, keys, side="right"))
+
+        labels = counts / self.num_annotators
+        outside = (times < self.start_video) | (times >= self.end_video)
+        labels[outside] = np.nan
+        return labels
+
+    def grid(self, step=LABEL_STEP):
+        """
+        Return the times of the clip that are multiples of step, as in the annotation CSV.
+        """
+        first_time = -(-self.start_video // step) * step
+        return np.arange(first_time, self.end_video, step, dtype=np.int64)
+
+    def to_frame(self, times=None):
+        """
+        Return the soft labels as a DataFrame with match_time and the label columns.
+
+        Args:
+            times (array-like): Query times; defaults to grid().
+        """
+        if times is None:
+            times = self.grid()
+        df = pd.DataFrame(self.query(times), columns=self.columns)
+        df.insert(0, "match_time", times)
+        return df
+
+
+def read_entries(json_files):
+    """
+    Read the entries of several arrange_annotation JSON files (one per annotator) into one list.
+    """
+    entries = []
+    for json_file in json_files:
+        with open(json_file, "r") as f:
+            entries.extend(json.load(f))
+    return entries
+
+
+def build_label_indexes(left_entries, right_entries, labels=FIXED_LABELS, num_annotators=NUM_ANNOTATORS):
+    """
+    Build the label index of every clip annotated for both teams.
+
+    Args:
+        left_entries (list of dict): arrange_annotation entries of all Left annotators.
+        right_entries (list of dict): arrange_annotation entries of all Right annotators.
+        labels (list of str): Labels of each team; intervals of other labels are ignored.
+        num_annotators (int): The counts are divided by this.
+
+    Returns:
+        dict: (game_id, start_video, end_video) -> LabelIndex, for the clips found on both sides.
+    """
+    columns = [f"{label}{suffix}" for suffix in SIDE_SUFFIXES for label in labels]
+    label_ids = {label: i for i, label in enumerate(labels)}
+
+    intervals = [defaultdict(list), defaultdict(list)]
+    for side, entries in enumerate((left_entries, right_entries)):
+        for entry in entries:
+            key = (entry["game_id"], entry["start_video"], entry["end_video"])
+            intervals[side][key].extend(
+                (side * len(labels) + label_ids[annotation["label"]], annotation["start"], annotation["end"])
+                for annotation in entry["annotations"]
+                if annotation["label"] in label_ids
+            )
+
+    indexes = {}
+    for key in intervals[0]:
+        if key not in intervals[1]:
+            continue
+        _, start_video, end_video = key
+        indexes[key] = LabelIndex(start_video, end_video, intervals[0][key] + intervals[1][key], columns, num_annotators)
+    return indexes
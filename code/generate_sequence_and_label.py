@@ -4,53 +4,354 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime
 import argparse
+import struct
+import json
+import hashlib
+import shutil
+import tempfile
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Number of windows gathered at a time in create_sequences
+WINDOW_BLOCK = 1024
+
+# Bump when the windowing changes so cached clips are rebuilt
+CACHE_VERSION = 2
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('--match_ids', required=True, help="Comma-separated list of match IDs to process")
+    parser.add_argument('--label_tolerance', type=float, default=0, help="Take the nearest label within this many ms (0: exact match only)")
+    parser.add_argument('--label_nearest', action='store_true', help="Take the nearest label regardless of distance")
+    parser.add_argument('--output_format', choices=['dense', 'compact'], default='dense',
+                        help="dense: one array of all windows; compact: unique frames plus window start offsets")
+    parser.add_argument('--cache_dir', default=None,
+                        help="Directory of a per-clip window cache, e.g. data/sequence_label/cache (default: no cache)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes that build clips in parallel")
+    parser.add_argument('--window_configs', default="20:5:including_future",
+                        help="Comma-separated window configurations, each sequence_length:fps[:including_future|past_only]")
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
     match_ids = [str(match_id) for match_id in args.match_ids.split(",")]
+    label_tolerance = np.inf if args.label_nearest else args.label_tolerance
+    cache_dir = args.cache_dir
+    configs = parse_window_configs(args.window_configs)
+
+    if args.output_format == 'compact':
+        save_compact(match_ids, configs, label_tolerance, cache_dir=cache_dir, workers=args.workers)
+    else:
+        save_dense(match_ids, configs, label_tolerance, cache_dir=cache_dir, workers=args.workers)
+
+
+def parse_window_configs(text):
+    """
+    Parse window configurations such as "20:5:including_future,10:5:past_only".
+
+    A configuration given more than once is kept once, since its outputs share a name.
+
+    Returns:
+        list of tuple: (sequence_length, fps, include_future) of each configuration.
+    """
+    configs = []
+    for item in text.split(","):
+        fields = item.strip().split(":")
+        if len(fields) not in (2, 3) or (len(fields) == 3 and fields[2] not in ('including_future', 'past_only')):
+            raise ValueError(f"Invalid window configuration: {item} (expected sequence_length:fps[:including_future|past_only])")
+        sequence_length, fps = int(fields[0]), int(fields[1])
+        if fps <= 0 or 25 % fps != 0:
+            raise ValueError(f"Invalid window configuration: {item} (fps must divide 25)")
+        include_future = len(fields) == 2 or fields[2] == 'including_future'
+        if (sequence_length, fps, include_future) in configs:
+            continue
+        configs.append((sequence_length, fps, include_future))
+    return configs
+
+
+def window_config_name(sequence_length, fps, include_future):
+    """
+    Name of the outputs of a window configuration.
+
+    The default 20 s / 5 fps configuration keeps the original names,
+    "including_future" or "past_only"; others get the length and rate appended.
+    """
+    name = 'including_future' if include_future else 'past_only'
+    if (sequence_length, fps) != (20, 5):
+        name += f"_{sequence_length}s_{fps}fps"
+    return name
+
+
+def save_dense(match_ids, configs, label_tolerance=0, cache_dir=None, workers=1):
+    """
+    Save the windows of the given matches as sequence_np_{name}.npy / label_np_{name}.npy per configuration.
+
+    Args:
+        match_ids (list of str): Matches to process.
+        configs (list): (sequence_length, fps, include_future) of each configuration.
+        label_tolerance (float): Passed on to create_sequences.
+        cache_dir (str): Per-clip cache directory, or None to build every clip.
+        workers (int): Number of processes that build clips in parallel.
+    """
+    builder = partial(create_window_sets, configs=configs, compact=False)
 
     # Output numpy file
     # 117093_09_22-10_07_, 128058_03_51-05_07_
-    output_sequence_numpy = "data/sequence_label/sequence_np_including_future.npy"
-    output_label_numpy = "data/sequence_label/label_np_including_future.npy"
-
-    all_sequences_list = []
-    all_labels_list = []
-
-    for match_id in match_ids:
-        # Directory containing tracking and annotation files
-        input_directory = f"data/interim/{match_id}"
-
-        sequences, labels = process_data(input_directory)
-        if sequences.size > 0 and labels.size > 0:
-            all_sequences_list.append(sequences)
-            all_labels_list.append(labels)
-
-    if all_sequences_list and all_labels_list:
-        # Combine all sequences and labels across matches
-        final_sequences = np.concatenate(all_sequences_list, axis=0)
-        final_labels = np.concatenate(all_labels_list, axis=0)
-
-        # Save combined sequences and labels
-        np.save(output_sequence_numpy, final_sequences)
-        np.save(output_label_numpy, final_labels)
-        print(f"Final sequences saved to {output_sequence_numpy}")
-        print(f"Final labels saved to {output_label_numpy}")
-    else:
-        print("No valid data to save.")
+    outputs = [
+        (f"data/sequence_label/sequence_np_{window_config_name(*config)}.npy",
+         f"data/sequence_label/label_np_{window_config_name(*config)}.npy")
+        for config in configs
+    ]
+
+    # Windows are appended to the .npy files clip by clip, so memory is bounded by one clip
+    writers = [(NpyAppender(output_sequence_numpy), NpyAppender(output_label_numpy))
+               for output_sequence_numpy, output_label_numpy in outputs]
+
+    try:
+        for match_id in match_ids:
+            # Directory containing tracking and annotation files
+            input_directory = f"data/interim/{match_id}"
+
+            clip_sequences = iter_clip_sequences(input_directory, label_tolerance, builder, cache_dir, workers)
+            for base_name, *results, rejected in clip_sequences:
+                for i, (sequence_writer, label_writer) in enumerate(writers):
+                    report_rejected_windows(f"{base_name} {window_config_name(*configs[i])}", *rejected[i])
+                    sequences, labels = results[2 * i:2 * i + 2]
+                    if sequences.size > 0 and labels.size > 0:
+                        sequence_writer.append(sequences)
+                        label_writer.append(labels)
 
+        for (sequence_writer, label_writer), (output_sequence_numpy, output_label_numpy) in zip(writers, outputs):
+            if sequence_writer.rows > 0:
+                # Save combined sequences and labels
+                sequence_writer.close()
+                label_writer.close()
+                print(f"Final sequences saved to {output_sequence_numpy}")
+                print(f"Final labels saved to {output_label_numpy}")
+            else:
+                print(f"No valid data to save for {output_sequence_numpy}.")
+    finally:
+        # Drops the partial files unless close() succeeded
+        for sequence_writer, label_writer in writers:
+            sequence_writer.discard()
+            label_writer.discard()
 
-def process_data(directory):
+
+def save_compact(match_ids, configs, label_tolerance=0, cache_dir=None, workers=1):
+    """
+    Save the windows of the given matches in the compact format, in compact_{name}/ per configuration.
+
+    Each output directory holds frames.npy (the stored frames of all clips),
+    window_starts.npy (the first row of each window in frames.npy), labels.npy
+    and metadata.json. Read it back with CompactSequences.
+
+    Args:
+        match_ids (list of str): Matches to process.
+        configs (list): (sequence_length, fps, include_future) of each configuration.
+        label_tolerance (float): Passed on to create_compact_sequences.
+        cache_dir (str): Per-clip cache directory, or None to build every clip.
+        workers (int): Number of processes that build clips in parallel.
+    """
+    builder = partial(create_window_sets, configs=configs, compact=True)
+    output_dirs = [f"data/sequence_label/compact_{window_config_name(*config)}" for config in configs]
+    writers = [
+        (NpyAppender(os.path.join(output_dir, "frames.npy")),
+         NpyAppender(os.path.join(output_dir, "window_starts.npy")),
+         NpyAppender(os.path.join(output_dir, "labels.npy")))
+        for output_dir in output_dirs
+    ]
+    clips = [[] for _ in configs]
+
+    try:
+        for match_id in match_ids:
+            input_directory = f"data/interim/{match_id}"
+
+            clip_sequences = iter_clip_sequences(input_directory, label_tolerance, builder, cache_dir, workers)
+            for base_name, *results, rejected in clip_sequences:
+                for i, (frame_writer, start_writer, label_writer) in enumerate(writers):
+                    report_rejected_windows(f"{base_name} {window_config_name(*configs[i])}", *rejected[i])
+                    frames, starts, labels = results[3 * i:3 * i + 3]
+                    if starts.size > 0 and labels.size > 0:
+                        clips[i].append({
+                            'name': base_name,
+                            'first_window': start_writer.rows,
+                            'windows': len(starts),
+                            'first_frame': frame_writer.rows,
+                            'frames': len(frames),
+                        })
+                        # Window starts are stored as offsets into the frames of all clips
+                        start_writer.append(starts + frame_writer.rows)
+                        frame_writer.append(frames)
+                        label_writer.append(labels)
+
+        for (frame_writer, start_writer, label_writer), output_dir, config, config_clips in zip(
+                writers, output_dirs, configs, clips):
+            if start_writer.rows > 0:
+                frame_writer.close()
+                start_writer.close()
+                label_writer.close()
+                sequence_length, fps, include_future = config
+                metadata = {
+                    'sequence_length': sequence_length,
+                    'fps': fps,
+                    'include_future': include_future,
+                    'window_length': sequence_length * fps,
+                    'num_windows': start_writer.rows,
+                    'num_frames': frame_writer.rows,
+                    'clips': config_clips,
+                }
+                with open(os.path.join(output_dir, "metadata.json"), "w") as f:
+                    json.dump(metadata, f, indent=2)
+                print(f"Compact dataset saved to {output_dir} ({start_writer.rows} windows, {frame_writer.rows} frames)")
+            else:
+                print(f"No valid data to save for {output_dir}.")
+    finally:
+        for frame_writer, start_writer, label_writer in writers:
+            frame_writer.discard()
+            start_writer.discard()
+            label_writer.discard()
+
+
+class CompactSequences:
+    """
+    Read a dataset saved by save_compact.
+
+    Window i is frames[starts[i]:starts[i] + window_length]. Indexing returns
+    that slice of the (memory-mapped) frame array, so no window is copied.
+
+    Example:
+        dataset = CompactSequences("data/sequence_label/compact_including_future")
+        sequence, label = dataset[0]
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        with open(os.path.join(directory, "metadata.json"), "r") as f:
+            self.metadata = json.load(f)
+        self.window_length = self.metadata['window_length']
+        self.frames = np.load(os.path.join(directory, "frames.npy"), mmap_mode=mmap_mode)
+        self.starts = np.load(os.path.join(directory, "window_starts.npy"))
+        self.labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return self.window(index), self.labels[index]
+
+    def window(self, index):
+        """
+        Return window index as a view of shape (window_length, features).
+        """
+        start = self.starts[index]
+        return self.frames[start:start + self.window_length]
+
+    def windows(self, indices):
+        """
+        Return a batch of windows, shape (len(indices), window_length, features).
+
+        A batch of arbitrary windows is not a view of the frame array, so this copies.
+        """
+        rows = self.starts[np.asarray(indices)][:, None] + np.arange(self.window_length)
+        return np.asarray(self.frames[rows])
+
+
+def process_data(directory, label_tolerance=0):
     sequences_list = []
     labels_list = []
 
+    for base_name, sequences, labels in iter_clip_sequences(directory, label_tolerance):
+        sequences_list.append(sequences)
+        labels_list.append(labels)
+
+    if sequences_list and labels_list:
+        # Combine all sequences and labels
+        all_sequences = np.concatenate(sequences_list, axis=0)
+        all_labels = np.concatenate(labels_list, axis=0)
+        return all_sequences, all_labels
+    else:
+        return np.array([]), np.array([])
+
+
+def iter_clip_sequences(directory, label_tolerance=0, builder=None, cache_dir=None, workers=1):
+    """
+    Yield the windows and labels of each clip in a match directory, in sorted order.
+
+    Args:
+        directory (str): Directory of the *_tracking_arranged.csv / *_annotation_combined.csv pairs.
+        label_tolerance (float): Passed on to the builder.
+        builder (callable): Defaults to create_sequences; create_compact_sequences for the compact format.
+        cache_dir (str): If given, a clip whose input files and parameters are unchanged
+            is read from its cached shard instead of being rebuilt (see load_cached_clip).
+        workers (int): With more than one worker, clips are built in a process pool.
+            Workers write their results to shards, which are read back in sorted
+            order, so the output is the same as with one worker.
+
+    Yields:
+        tuple: (base_name, *builder results) for each clip, i.e. (base_name, sequences, labels) by default.
+    """
+    if builder is None:
+        builder = create_sequences
+
+    clips = list_clips(directory)
+    shards = [
+        clip_cache_path(cache_dir, base_name, tracking_file, annotation_file, builder, label_tolerance)
+        if cache_dir is not None else None
+        for base_name, tracking_file, annotation_file in clips
+    ]
+
+    if workers <= 1:
+        for (base_name, tracking_file, annotation_file), shard in zip(clips, shards):
+            results = load_cached_clip(shard) if shard is not None else None
+            if results is not None:
+                print(base_name, *(result.shape for result in results), "(cached)")
+            else:
+                results = build_clip(base_name, tracking_file, annotation_file, builder, label_tolerance)
+                if shard is not None:
+                    save_cached_clip(shard, results)
+            yield (base_name,) + tuple(results)
+        return
+
+    # Without a cache the workers write to temporary shards, removed once read
+    temp_dir = tempfile.mkdtemp(prefix="sequence_shards_") if cache_dir is None else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for index, ((base_name, tracking_file, annotation_file), shard) in enumerate(zip(clips, shards)):
+                if shard is not None and shard.exists():
+                    futures.append(None)
+                    continue
+                if shard is None:
+                    shard = Path(temp_dir) / f"{index:05d}_{base_name}.npz"
+                    shards[index] = shard
+                futures.append(executor.submit(
+                    build_clip_shard, base_name, tracking_file, annotation_file, builder, label_tolerance,
+                    shard, cache_dir is not None))
+
+            for (base_name, _, _), shard, future in zip(clips, shards, futures):
+                if future is not None:
+                    future.result()
+                results = load_cached_clip(shard)
+                if future is None:
+                    print(base_name, *(result.shape for result in results), "(cached)")
+                if temp_dir is not None:
+                    shard.unlink()
+                yield (base_name,) + tuple(results)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def list_clips(directory):
+    """
+    List the clips of a match directory that have both a tracking and an annotation file.
+
+    Returns:
+        list of tuple: (base_name, tracking_file, annotation_file), sorted by annotation file.
+    """
+    clips = []
     # Get all annotation files
     annotation_files = sorted(Path(directory).rglob("*_annotation_combined.csv"))
     for annotation_file in annotation_files:
@@ -68,66 +369,572 @@ def process_data(directory):
             print(f"Tracking file not found for {annotation_file.name}. Skipping.")
             continue
 
-        print(f"Processing {tracking_file.name} and {annotation_file.name}...")
-        # Load tracking and annotation data
-        tracking_data = pd.read_csv(tracking_file)
-        annotation_data = pd.read_csv(annotation_file)
+        clips.append((base_name, tracking_file, annotation_file))
+    return clips
 
-        # Create sequences and labels
-        sequences, labels = create_sequences(tracking_data, annotation_data)
-        print(base_name, sequences.shape, labels.shape)
-        sequences_list.append(sequences)
-        labels_list.append(labels)
 
-    if sequences_list and labels_list:
-        # Combine all sequences and labels
-        all_sequences = np.concatenate(sequences_list, axis=0)
-        all_labels = np.concatenate(labels_list, axis=0)
-        return all_sequences, all_labels
+def build_clip(base_name, tracking_file, annotation_file, builder, label_tolerance):
+    """
+    Read the CSV files of a clip and build its windows and labels.
+    """
+    print(f"Processing {tracking_file.name} and {annotation_file.name}...")
+    # Load tracking and annotation data
+    tracking_data = pd.read_csv(tracking_file)
+    annotation_data = pd.read_csv(annotation_file)
+
+    # Create sequences and labels
+    results = builder(tracking_data, annotation_data, label_tolerance=label_tolerance)
+    print(base_name, *(result.shape for result in results))
+    return results
+
+
+def build_clip_shard(base_name, tracking_file, annotation_file, builder, label_tolerance, shard, cached):
+    """
+    Build a clip in a worker process and write the results to a shard instead of returning them.
+    """
+    results = build_clip(base_name, tracking_file, annotation_file, builder, label_tolerance)
+    if cached:
+        save_cached_clip(shard, results)
     else:
-        return np.array([]), np.array([])
+        write_shard(shard, results)
+
+
+def clip_cache_path(cache_dir, base_name, tracking_file, annotation_file, builder, label_tolerance):
+    """
+    Return the cache shard of a clip for its current input files and window parameters.
+
+    The shard is {cache_dir}/{base_name}/{parameter hash}_{input hash}.npz. The
+    parameter hash covers the builder, its keyword arguments, label_tolerance and
+    CACHE_VERSION; the input hash covers the contents of both CSV files.
+    """
+    if isinstance(builder, partial):
+        parameters = {'builder': builder.func.__name__, **builder.keywords}
+    else:
+        parameters = {'builder': builder.__name__}
+    parameters.update(label_tolerance=label_tolerance, version=CACHE_VERSION)
+    parameter_hash = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+    input_hash = hashlib.sha256()
+    for path in (tracking_file, annotation_file):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                input_hash.update(block)
+
+    return Path(cache_dir) / base_name / f"{parameter_hash[:16]}_{input_hash.hexdigest()[:16]}.npz"
+
+
+def load_cached_clip(shard):
+    """
+    Return the arrays stored in a cache shard, or None if there is no shard.
+    """
+    if not shard.exists():
+        return None
+    with np.load(shard) as data:
+        return tuple(data[f"arr_{i}"] for i in range(len(data.files)))
+
+
+def save_cached_clip(shard, results):
+    """
+    Store the arrays of a clip in its cache shard.
 
+    Every other shard of the clip is removed, so the cache holds at most one
+    shard per clip: the one of the latest input files and parameters.
+    """
+    shard.parent.mkdir(parents=True, exist_ok=True)
+    for old_shard in shard.parent.glob("*.npz"):
+        old_shard.unlink()
+    write_shard(shard, results)
 
-def create_sequences(tracking_data, annotation_data, sequence_length=20, fps=5):
+
+def write_shard(shard, results):
+    """
+    Write the arrays of a clip to an .npz file through a temporary file.
+    """
+    temp_path = shard.with_suffix(".tmp")
+    with open(temp_path, "wb") as f:
+        np.savez(f, *results)
+    os.replace(temp_path, shard)
+
+
+class NpyAppender:
+    """
+    Write a .npy file incrementally by appending arrays along the first axis.
+
+    Data is streamed to a temporary file behind a fixed-size header, which is
+    rewritten with the final shape on close() before the file is moved into
+    place. The result is a regular .npy file that np.load can memory-map.
+    """
+
+    HEADER_SIZE = 256
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.temp_path = f"{self.path}.tmp"
+        self.file = None
+        self.dtype = None
+        self.row_shape = None
+        self.rows = 0
+
+    def append(self, array):
+        """
+        Append an array; its trailing shape must match the arrays appended so far.
+        """
+        array = np.asarray(array)
+        if self.file is None:
+            self.dtype = array.dtype
+            self.row_shape = array.shape[1:]
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.temp_path, "wb")
+            self.file.write(self._header())
+        elif array.shape[1:] != self.row_shape:
+            raise ValueError(f"Cannot append shape {array.shape} to {self.path} with rows of shape {self.row_shape}")
+        elif array.dtype != self.dtype:
+            if not np.can_cast(array.dtype, self.dtype, casting="same_kind"):
+                raise ValueError(f"Cannot append dtype {array.dtype} to {self.path} of dtype {self.dtype}")
+            array = array.astype(self.dtype)
+
+        self.file.write(np.ascontiguousarray(array).tobytes())
+        self.rows += len(array)
+
+    def close(self):
+        """
+        Write the final header and move the file into place.
+        """
+        if self.file is None:
+            return
+        self.file.seek(0)
+        self.file.write(self._header())
+        self.file.close()
+        self.file = None
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """
+        Remove the temporary file if the writer was not closed.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def _header(self):
+        header = repr({
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (self.rows,) + self.row_shape,
+        }).encode('latin1')
+        # Format 1.0: magic, version, header length, then the header padded with spaces and ended by a newline
+        padding = self.HEADER_SIZE - 10 - len(header) - 1
+        if padding < 0:
+            raise ValueError(f"Header of {self.path} does not fit in {self.HEADER_SIZE} bytes")
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', self.HEADER_SIZE - 10) + header + b' ' * padding + b'\n'
+
+
+def create_sequences(tracking_data, annotation_data, sequence_length=20, fps=5, label_tolerance=0, include_future=True,
+                     return_rejected=False):
+    """
+    Cut a clip into windows of sampled tracking frames and their labels.
+
+    A window is centred on every frame_step-th row. It covers the rows within
+    +/-sequence_length / 2 s of the centre time rounded to 40 ms (the
+    sequence_length s up to the centre time if include_future is False). Of those rows, the last
+    25 * sequence_length - 4 are kept, with zero rows in front when there are
+    fewer, and num_frames of them are sampled at fixed offsets. Windows that
+    contain NaN are skipped.
+
+    Every window's row range is found with a binary search on match_time.
+    Windows with NaN are found from prefix sums before any window is built
+    (see valid_windows), and only the valid windows are gathered, in blocks.
+
+    Args:
+        tracking_data (DataFrame): Arranged tracking data; match_time followed by the features.
+            The (match_time, values) arrays from tracking_arrays are also accepted.
+        annotation_data (DataFrame): Combined annotation; match_time followed by the labels.
+        sequence_length (int): Window length in seconds.
+        fps (int): Sampling rate of the window in frames per second.
+        label_tolerance (float): 0 takes the label at exactly the centre time.
+            A positive value takes the nearest label within that many ms (see lookup_labels).
+        include_future (bool): False ends each window at its current time (see prepare_windows).
+        return_rejected (bool): Return the rejected and total window counts instead of printing them.
+
+    Returns:
+        tuple: (sequences (windows, num_frames, features), labels (windows, labels)),
+            or two empty arrays if there is no valid window. With return_rejected,
+            followed by (rejected windows, total windows).
+    """
+    values, current_times, lo, hi, sampled_offsets = prepare_windows(tracking_data, sequence_length, fps, include_future)
+
+    # NaNを含むシーケンスをスキップ (ウィンドウを作る前に判定)
+    valid = valid_windows(values, lo, hi, sampled_offsets)
+    rejected = (len(valid) - np.count_nonzero(valid), len(valid))
+    if not return_rejected:
+        report_rejected_windows(window_config_name(sequence_length, fps, include_future), *rejected)
+    indices = np.flatnonzero(valid)
+    if len(indices) == 0:
+        return (np.array([]), np.array([])) + ((rejected,) if return_rejected else ())
+
+    sequence_data = np.empty((len(indices), len(sampled_offsets), values.shape[1]), dtype=values.dtype)
+    for block in range(0, len(indices), WINDOW_BLOCK):
+        block_indices = indices[block:block + WINDOW_BLOCK]
+        sequence_data[block:block + len(block_indices)] = gather_windows(
+            values, lo[block_indices], hi[block_indices], sampled_offsets)
+
+    # 対応するラベルデータを取得
+    label_data = lookup_labels(annotation_data, current_times[indices], label_tolerance)
+
+    if return_rejected:
+        return sequence_data, label_data, rejected
+    return sequence_data, label_data
+
+
+def create_compact_sequences(tracking_data, annotation_data, sequence_length=20, fps=5, label_tolerance=0,
+                             include_future=True, return_rejected=False):
+    """
+    Cut a clip into the same windows as create_sequences, stored without repeating frames.
+
+    Consecutive windows overlap by all but a few frames. The sampled offsets of a
+    window are evenly spaced, so with the zero padding put in front of the clip,
+    every window is a run of num_frames consecutive rows of one strided slice of
+    the clip (rows r, r + stride, r + 2 * stride, ...). Each slice that windows
+    use is stored once, and a window is kept as its start row in the stored frames.
+
+    Windows whose range starts after the first row of the clip but that still
+    reach back before it (gaps in the tracking) are padded with zeros instead of
+    the earlier rows. They are stored as separate copies, as is every window when
+    the offsets are not evenly spaced.
+
+    Args:
+        tracking_data (DataFrame): Arranged tracking data; match_time followed by the features.
+        annotation_data (DataFrame): Combined annotation; match_time followed by the labels.
+        sequence_length (int): Window length in seconds.
+        fps (int): Sampling rate of the window in frames per second.
+        label_tolerance (float): See create_sequences.
+        include_future (bool): See create_sequences.
+        return_rejected (bool): See create_sequences.
+
+    Returns:
+        tuple: (frames (stored frames, features), starts (windows,), labels (windows, labels)).
+            Window i equals frames[starts[i]:starts[i] + num_frames], and the windows
+            and labels are those create_sequences returns. Three empty arrays if there
+            is no valid window. With return_rejected, followed by (rejected windows, total windows).
+    """
+    values, current_times, lo, hi, sampled_offsets = prepare_windows(tracking_data, sequence_length, fps, include_future)
+    num_frames = len(sampled_offsets)
+    padding = -sampled_offsets[0]
+    steps = np.diff(sampled_offsets)
+    # Evenly spaced offsets are needed to share frames; otherwise every window is stored as a copy
+    shared = len(steps) > 0 and steps[0] > 0 and np.all(steps == steps[0])
+    stride = int(steps[0]) if shared else 1
+
+    # NaNを含むシーケンスをスキップ
+    valid = valid_windows(values, lo, hi, sampled_offsets)
+    rejected = (len(valid) - np.count_nonzero(valid), len(valid))
+    if not return_rejected:
+        report_rejected_windows(window_config_name(sequence_length, fps, include_future), *rejected)
+    if not valid.any():
+        return (np.array([]), np.array([]), np.array([])) + ((rejected,) if return_rejected else ())
+
+    # 範囲より前の行がゼロになるウィンドウ (クリップ先頭以外)
+    irregular = valid & (~shared | ((lo > 0) & (hi + sampled_offsets[0] < lo)))
+    irregular_indices = np.flatnonzero(irregular)
+    irregular_windows = [
+        gather_windows(values, lo[block_indices], hi[block_indices], sampled_offsets)
+        for block_indices in np.split(irregular_indices, np.arange(WINDOW_BLOCK, len(irregular_indices), WINDOW_BLOCK))
+    ]
+
+    padded = np.concatenate([np.zeros((padding, values.shape[1]), dtype=values.dtype), values])
+    # A window's first sampled row hi + sampled_offsets[0] is row hi of the padded array
+    first_rows = hi
+    starts = np.zeros(len(current_times), dtype=np.int64)
+    segments = []
+    stored = 0
+
+    regular = valid & ~irregular
+    residues = first_rows % stride
+    for residue in np.unique(residues[regular]):
+        selected = np.flatnonzero(regular & (residues == residue))
+        positions = first_rows[selected] // stride
+        # Windows of one slice that overlap share a segment; a gap in the tracking starts a new one
+        order = np.argsort(positions, kind="stable")
+        breaks = np.flatnonzero(np.diff(positions[order]) >= num_frames) + 1
+        for run in np.split(order, breaks):
+            first, last = positions[run[0]], positions[run[-1]]
+            segments.append(padded[residue::stride][first:last + num_frames])
+            starts[selected[run]] = stored + positions[run] - first
+            stored += len(segments[-1])
+
+    irregular_windows = np.concatenate(irregular_windows, axis=0)
+    segments.append(irregular_windows.reshape(-1, values.shape[1]))
+    starts[irregular] = stored + num_frames * np.arange(len(irregular_windows))
+
+    frames = np.concatenate(segments, axis=0)
+    label_data = lookup_labels(annotation_data, current_times[valid], label_tolerance)
+
+    if return_rejected:
+        return frames, starts[valid], label_data, rejected
+    return frames, starts[valid], label_data
+
+
+def create_window_sets(tracking_data, annotation_data, configs, compact=False, label_tolerance=0):
+    """
+    Build the windows of a clip for several window configurations.
+
+    The tracking arrays are extracted and sorted once and shared by all configurations.
+
+    Args:
+        tracking_data (DataFrame): Arranged tracking data; match_time followed by the features.
+        annotation_data (DataFrame): Combined annotation; match_time followed by the labels.
+        configs (list): (sequence_length, fps, include_future) of each configuration.
+        compact (bool): Build with create_compact_sequences instead of create_sequences.
+        label_tolerance (float): See create_sequences.
+
+    Returns:
+        tuple: The results of every configuration, one after another
+            (2 arrays per configuration, or 3 when compact), followed by the
+            (configurations, 2) array of rejected and total window counts
+            (see report_rejected_windows). The counts are kept with the windows
+            so that clips read from the cache are reported too.
+    """
+    builder = create_compact_sequences if compact else create_sequences
+    tracking = tracking_arrays(tracking_data)
+    results = ()
+    rejected = []
+    for sequence_length, fps, include_future in configs:
+        *arrays, counts = builder(tracking, annotation_data, sequence_length, fps, label_tolerance, include_future,
+                                  return_rejected=True)
+        results += tuple(arrays)
+        rejected.append(counts)
+    return results + (np.array(rejected, dtype=np.int64).reshape(-1, 2),)
+
+
+def lookup_labels(annotation_data, times, tolerance=0):
+    """
+    Look up the label row of each query time with one sorted join.
+
+    With tolerance 0, a time gets the first annotation row with exactly that
+    match_time. With a positive tolerance, it gets the nearest annotation time
+    within tolerance ms; on a tie the earlier time wins. Use np.inf for the
+    nearest time without a limit. Times without a match get zeros.
+
+    annotation_data may also be a label index of the clip (annotation/label_index.py),
+    which gives the labels at exactly the query times; tolerance is then unused.
+
+    Args:
+        annotation_data (DataFrame or LabelIndex): Combined annotation; match_time followed by the labels.
+        times (numpy.ndarray): Query times (ms).
+        tolerance (float): Largest allowed distance to an annotation time (ms).
+
+    Returns:
+        numpy.ndarray: Label rows, shape (len(times), labels).
+
+    Example:
+        >>> annotation = pd.DataFrame({'match_time': [0, 200], 'Build up 1': [0.25, 0.5]})
+        >>> lookup_labels(annotation, np.array([200, 0, 100]))
+        array([[0.5 ],
+               [0.25],
+               [0.  ]])
+    """
+    if not isinstance(annotation_data, pd.DataFrame):
+        # クリップ外の時刻はゼロ
+        labels = annotation_data.query(times)
+        labels[np.isnan(labels).all(axis=1)] = 0
+        return labels
+
+    annotation_times = annotation_data['match_time'].to_numpy()
+    label_values = annotation_data.iloc[:, 1:].to_numpy()  # match_timeを除外
+
+    # 安定ソートで同じ時刻の行は最初の行が先頭に来る
+    order = np.argsort(annotation_times, kind="stable")
+    sorted_times = annotation_times[order]
+
+    after = np.searchsorted(sorted_times, times, side="left")
+    if len(sorted_times) == 0:
+        candidate = after
+        matched = np.zeros(len(times), dtype=bool)
+    elif tolerance == 0:
+        candidate = np.minimum(after, len(sorted_times) - 1)
+        matched = sorted_times[candidate] == times
+    else:
+        # Nearest of the time before and the time at or after each query
+        before = np.maximum(after - 1, 0)
+        at_or_after = np.minimum(after, len(sorted_times) - 1)
+        distance_before = np.where(after > 0, times - sorted_times[before], np.inf)
+        distance_after = np.where(after < len(sorted_times), sorted_times[at_or_after] - times, np.inf)
+        candidate = np.where(distance_after < distance_before, at_or_after, before)
+        matched = np.minimum(distance_before, distance_after) <= tolerance
+        # First row among rows sharing the chosen time
+        candidate = np.searchsorted(sorted_times, sorted_times[candidate], side="left")
+
+    # ゼロ埋めが混ざると np.array と同じく浮動小数に揃える
+    if not matched.any():
+        dtype = np.float64
+    elif matched.all():
+        dtype = label_values.dtype
+    else:
+        dtype = np.result_type(label_values.dtype, np.float64)
+    labels = np.zeros((len(times), label_values.shape[1]), dtype=dtype)
+    labels[matched] = label_values[order[candidate[matched]]]
+    return labels
+
+
+def prepare_windows(tracking_data, sequence_length=20, fps=5, include_future=True):
+    """
+    Compute the feature rows, centre times, row ranges and sample offsets of a clip's windows.
+
+    Args:
+        tracking_data (DataFrame or tuple): Arranged tracking data, or its arrays from tracking_arrays.
+        sequence_length (int): Window length in seconds.
+        fps (int): Sampling rate of the window in frames per second.
+        include_future (bool): Centre the window on the current time (half of it in the future)
+            instead of ending it at the current time.
+
+    Returns:
+        tuple: (values, current_times, lo, hi, sampled_offsets); see window_bounds and gather_windows.
+    """
     # 1秒間のフレーム数 (デフォルト25fpsから計算)
     frame_step = 25 // fps
     original_frames = 25 * sequence_length - 4
     num_frames = sequence_length * fps  # 20秒 × 5fps = 100フレーム
-    sequence_data = []
-    label_data = []
 
-    for idx in range(0, len(tracking_data), frame_step):
-        current_time = tracking_data.iloc[idx]['match_time']
-        # current_time を 40 の倍数に補正
-        current_time = round(current_time / 40) * 40
+    if isinstance(tracking_data, tuple):
+        match_time, values = tracking_data
+    else:
+        match_time, values = tracking_arrays(tracking_data)
 
-        start_time = current_time - 10 * 1000  # ミリ秒単位
-        end_time = current_time + 10 * 1000
+    # 各ウィンドウの中心時刻と行範囲 [lo, hi)
+    if include_future:
+        before = after = sequence_length * 1000 // 2
+    else:
+        before, after = sequence_length * 1000, 0
+    current_times, lo, hi = window_bounds(match_time, frame_step, before, after)
 
-        # データを取得 (不足時はゼロ埋め)
-        past_data = tracking_data[(tracking_data['match_time'] >= start_time) & (tracking_data['match_time'] <= end_time)]
-        if len(past_data) < original_frames:
-            padding = pd.DataFrame(0, index=np.arange(original_frames - len(past_data)), columns=tracking_data.columns)
-            past_data = pd.concat([padding, past_data])
+    # 等間隔でサンプリング (現在のフレームを含める)
+    sampled_offsets = np.linspace(-original_frames, -1, num=num_frames, dtype=int)
 
-        # 等間隔でサンプリング (現在のフレームを含める)
-        sampled_indices = np.linspace(-original_frames, -1, num=num_frames, dtype=int)
-        sampled_data = past_data.iloc[sampled_indices, 1:].values  # match_timeを除外
+    return values, current_times, lo, hi, sampled_offsets
 
-        # NaNを含むシーケンスをスキップ
-        if np.isnan(sampled_data).any():
-            continue
 
-        sequence_data.append(sampled_data)
+def tracking_arrays(tracking_data):
+    """
+    Return the match_time and feature rows of arranged tracking data, sorted by match_time.
+
+    Args:
+        tracking_data (DataFrame): Arranged tracking data; match_time followed by the features.
+
+    Returns:
+        tuple: (match_time (rows,), values (rows, features)).
+    """
+    match_time = tracking_data['match_time'].to_numpy()
+    values = tracking_data.iloc[:, 1:].to_numpy()  # match_timeを除外
+    if np.any(match_time[1:] < match_time[:-1]):
+        print("Warning: tracking data is not sorted by match_time; sorting it.")
+        order = np.argsort(match_time, kind="stable")
+        match_time = match_time[order]
+        values = values[order]
+    return match_time, values
+
+
+def window_bounds(match_time, frame_step, before=10 * 1000, after=10 * 1000):
+    """
+    Compute the centre time and row range of every window of a clip.
+
+    Args:
+        match_time (numpy.ndarray): Sorted match_time of each tracking row (ms).
+        frame_step (int): A window is centred on every frame_step-th row.
+        before (int): Window extent before the centre time (ms).
+        after (int): Window extent after the centre time (ms).
+
+    Returns:
+        tuple: (centre times rounded to 40 ms, first row, one past the last row)
+            of each window, as int64 arrays.
+    """
+    # current_time を 40 の倍数に補正 (round と同じく偶数丸め)
+    current_times = (np.round(match_time[::frame_step] / 40) * 40).astype(np.int64)
+    lo = np.searchsorted(match_time, current_times - before, side="left")
+    hi = np.searchsorted(match_time, current_times + after, side="right")
+    return current_times, lo, hi
+
+
+def valid_windows(values, lo, hi, sampled_offsets):
+    """
+    Find the windows whose sampled frames contain no NaN, without gathering the frames.
+
+    With evenly spaced offsets, the sampled rows of a window are every stride-th
+    row from its first row inside [lo, hi), so the number of NaN rows among them
+    is the difference of two prefix sums taken within each residue class of the
+    row index modulo stride. Other offsets fall back to gathering one NaN flag
+    per sampled row. Sampled rows before lo are zeros and never NaN.
+
+    Args:
+        values (numpy.ndarray): Feature rows of the clip, shape (rows, features).
+        lo (numpy.ndarray): First row of each window.
+        hi (numpy.ndarray): One past the last row of each window.
+        sampled_offsets (numpy.ndarray): Negative offsets of the sampled frames.
+
+    Returns:
+        numpy.ndarray: Boolean array, True for the windows without NaN.
+    """
+    nan_rows = np.isnan(values).any(axis=1)
+    steps = np.diff(sampled_offsets)
+
+    if len(steps) > 0 and steps[0] > 0 and np.all(steps == steps[0]):
+        stride = int(steps[0])
+        # Row i is at i + stride; the stride leading zeros make the prefix before row 0 valid
+        padded = np.concatenate([np.zeros(stride, dtype=np.int64), nan_rows.astype(np.int64)])
+        padded = np.concatenate([padded, np.zeros(-len(padded) % stride, dtype=np.int64)])
+        # nan_counts[i] = padded[i] + padded[i - stride] + padded[i - 2 * stride] + ...
+        nan_counts = padded.reshape(-1, stride).cumsum(axis=0).ravel()
+
+        first = hi + sampled_offsets[0]
+        last = hi + sampled_offsets[-1]
+        # First sampled row at or after lo
+        start = first + np.maximum(0, -((first - lo) // stride)) * stride
+        counts = nan_counts[np.maximum(last, start - stride) + stride] - nan_counts[start]
+        return counts == 0
+
+    valid = np.empty(len(lo), dtype=bool)
+    for block in range(0, len(lo), WINDOW_BLOCK):
+        block_slice = slice(block, block + WINDOW_BLOCK)
+        rows = hi[block_slice, None] + sampled_offsets[None, :]
+        inside = rows >= lo[block_slice, None]
+        valid[block_slice] = ~(nan_rows[np.where(inside, rows, 0)] & inside).any(axis=1)
+    return valid
+
+
+def report_rejected_windows(name, rejected, total):
+    """
+    Print how many windows of a clip were rejected for containing NaN.
+
+    Args:
+        name (str): Clip and/or window configuration the counts belong to.
+        rejected (int): Number of windows that contain NaN.
+        total (int): Number of windows of the clip.
+    """
+    print(f"{name}: rejected {rejected} of {total} windows containing NaN")
+
+
+def gather_windows(values, lo, hi, sampled_offsets):
+    """
+    Gather the sampled frames of a block of windows.
+
+    Offsets count back from the end of each window's row range. Offsets that fall
+    before the start of the range select zero rows, as the zero padding did.
 
-        # 対応するラベルデータを取得
-        label = annotation_data[annotation_data['match_time'] == current_time].iloc[:, 1:].values  # match_timeを除外
-        if len(label) > 0:
-            label_data.append(label[0])
-        else:
-            label_data.append(np.zeros(annotation_data.shape[1] - 1))
+    Args:
+        values (numpy.ndarray): Feature rows of the clip, shape (rows, features).
+        lo (numpy.ndarray): First row of each window.
+        hi (numpy.ndarray): One past the last row of each window.
+        sampled_offsets (numpy.ndarray): Negative offsets of the sampled frames.
 
-    return np.array(sequence_data), np.array(label_data)
+    Returns:
+        numpy.ndarray: Shape (windows, len(sampled_offsets), features).
+    """
+    rows = hi[:, None] + sampled_offsets[None, :]
+    inside = rows >= lo[:, None]
+    windows = values[np.where(inside, rows, 0)]
+    windows[~inside] = 0
+    return windows
 
 
 if __name__ == "__main__":
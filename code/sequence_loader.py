@@ -0,0 +1,184 @@
+"""
+Batch loader for the arrays written by generate_sequence_and_label.py.
+
+The sequence and label files are opened with np.load(mmap_mode='r'), so opening
+them is instant and only the windows of the batches being assembled are read.
+Shuffling uses a bounded buffer of window indices: the dataset is read block by
+block (blocks in random order), and batches are drawn at random from the blocks
+currently in the buffer. A background thread assembles the next batches while
+the current one is used.
+
+Usage:
+    from sequence_loader import SequenceLoader
+
+    loader = SequenceLoader(batch_size=64, shuffle=True, seed=0)
+    for sequences, labels in loader:
+        ...
+
+    python sequence_loader.py --batch_size 64
+
+Arguments:
+    --sequence_file: Sequence .npy file (default: data/sequence_label/sequence_np_including_future.npy).
+    --label_file: Label .npy file (default: data/sequence_label/label_np_including_future.npy).
+    --batch_size: Windows per batch (default: 64).
+    --shuffle_buffer: Maximum number of windows the shuffle draws from (default: 16384).
+    --prefetch: Number of batches assembled ahead (default: 4).
+    --no_shuffle: Read the windows in order.
+"""
+
+import argparse
+import queue
+import threading
+import time
+import numpy as np
+
+
+class SequenceLoader:
+    """
+    Iterate over (sequences, labels) batches of memory-mapped .npy files.
+
+    Every epoch visits each window once. With shuffle=False the batches are in
+    file order. Batches are regular in-memory arrays; memory use is bounded by
+    shuffle_buffer indices and prefetch + 1 batches, whatever the file size.
+    """
+
+    def __init__(self,
+                 sequence_file="data/sequence_label/sequence_np_including_future.npy",
+                 label_file="data/sequence_label/label_np_including_future.npy",
+                 batch_size=64, shuffle=True, shuffle_buffer=16384, block_size=1024,
+                 prefetch=4, drop_last=False, seed=None):
+        """
+        Args:
+            sequence_file (str): Path to the sequence .npy file.
+            label_file (str): Path to the label .npy file.
+            batch_size (int): Windows per batch.
+            shuffle (bool): Shuffle the windows every epoch.
+            shuffle_buffer (int): Maximum number of windows the shuffle draws from.
+            block_size (int): Consecutive windows read into the buffer at a time.
+            prefetch (int): Number of batches assembled ahead by the background thread.
+            drop_last (bool): Drop the last batch if it is smaller than batch_size.
+            seed (int): Seed of the shuffle.
+        """
+        self.sequences = np.load(sequence_file, mmap_mode='r')
+        self.labels = np.load(label_file, mmap_mode='r')
+        if len(self.sequences) != len(self.labels):
+            raise ValueError(f"{sequence_file} has {len(self.sequences)} windows but {label_file} has {len(self.labels)}")
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.block_size = max(1, min(block_size, self.shuffle_buffer))
+        self.prefetch = max(1, prefetch)
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sequences) // self.batch_size
+        return -(-len(self.sequences) // self.batch_size)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=self._fill, args=(batches, stop), daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Let the thread finish if the consumer stops early
+            stop.set()
+            while worker.is_alive():
+                try:
+                    batches.get_nowait()
+                except queue.Empty:
+                    worker.join(timeout=0.1)
+
+    def _fill(self, batches, stop):
+        try:
+            for indices in self.batch_indices():
+                if stop.is_set():
+                    return
+                batches.put(self.load_batch(indices))
+            batches.put(None)
+        except BaseException as e:
+            batches.put(e)
+
+    def batch_indices(self):
+        """
+        Yield the window indices of each batch of one epoch.
+        """
+        total = len(self.sequences)
+        if not self.shuffle:
+            for start in range(0, total, self.batch_size):
+                indices = np.arange(start, min(start + self.batch_size, total))
+                if len(indices) == self.batch_size or not self.drop_last:
+                    yield indices
+            return
+
+        block_starts = np.arange(0, total, self.block_size)
+        self.rng.shuffle(block_starts)
+        buffer = np.empty(0, dtype=np.int64)
+        for block_start in block_starts:
+            block = np.arange(block_start, min(block_start + self.block_size, total))
+            buffer = np.concatenate([buffer, block])
+            # バッファが一杯になったらランダムにバッチを取り出す
+            while len(buffer) > self.shuffle_buffer - self.block_size and len(buffer) >= self.batch_size:
+                buffer, indices = self._draw(buffer, self.batch_size)
+                yield indices
+
+        self.rng.shuffle(buffer)
+        for start in range(0, len(buffer), self.batch_size):
+            indices = buffer[start:start + self.batch_size]
+            if len(indices) == self.batch_size or not self.drop_last:
+                yield indices
+
+    def load_batch(self, indices):
+        """
+        Read the windows and labels at the given indices into contiguous arrays.
+        """
+        # Read in file order for locality, then restore the requested order
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        sequences = np.empty((len(indices),) + self.sequences.shape[1:], dtype=self.sequences.dtype)
+        labels = np.empty((len(indices),) + self.labels.shape[1:], dtype=self.labels.dtype)
+        sequences[order] = self.sequences[sorted_indices]
+        labels[order] = self.labels[sorted_indices]
+        return sequences, labels
+
+    def _draw(self, buffer, count):
+        picked = self.rng.choice(len(buffer), size=count, replace=False)
+        keep = np.ones(len(buffer), dtype=bool)
+        keep[picked] = False
+        return buffer[keep], buffer[picked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Iterate one epoch over the generated sequences and report the throughput.")
+    parser.add_argument('--sequence_file', default="data/sequence_label/sequence_np_including_future.npy", help="Sequence .npy file")
+    parser.add_argument('--label_file', default="data/sequence_label/label_np_including_future.npy", help="Label .npy file")
+    parser.add_argument('--batch_size', type=int, default=64, help="Windows per batch")
+    parser.add_argument('--shuffle_buffer', type=int, default=16384, help="Maximum number of windows the shuffle draws from")
+    parser.add_argument('--prefetch', type=int, default=4, help="Number of batches assembled ahead")
+    parser.add_argument('--no_shuffle', action='store_true', help="Read the windows in order")
+    args = parser.parse_args()
+
+    loader = SequenceLoader(args.sequence_file, args.label_file, batch_size=args.batch_size,
+                            shuffle=not args.no_shuffle, shuffle_buffer=args.shuffle_buffer, prefetch=args.prefetch)
+    print(f"{len(loader.sequences)} windows of shape {loader.sequences.shape[1:]}, {len(loader)} batches")
+
+    start = time.time()
+    windows = 0
+    for sequences, labels in loader:
+        windows += len(sequences)
+    elapsed = time.time() - start
+    print(f"Read {windows} windows in {elapsed:.2f} s ({windows / max(elapsed, 1e-9):.0f} windows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 import argparse
-import csv
+import os
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from loguru import logger
 import json
+import numpy as np
+import pandas as pd
+from task_pool import run_tasks, report_failures
+
+
+# Number of tracking rows processed at a time
+CHUNK_SIZE = 500000
 
 
 def main():
@@ -12,24 +19,35 @@ def main():
     """
     parser = argparse.ArgumentParser(description="Add team_id and position to tracking CSV files based on player_id.")
     parser.add_argument("--match_id", required=True, type=str, help="The match identifier to process.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of matches processed in parallel.")
     args = parser.parse_args()
     match_ids = [str(match_id) for match_id in args.match_id.split(",")]
 
-    for match_id in match_ids:
-        tracking_csv = f"raw/tracking/{match_id}/{match_id}_pitch_plane_coordinates.csv"
+    tasks = [(match_id, (match_id,)) for match_id in match_ids]
+    report_failures(run_tasks(add_team_and_position_to_match, tasks, args.workers))
 
-        if not Path(tracking_csv).exists():
-            logger.error(f"Tracking CSV file not found: {tracking_csv}")
-            continue
 
-        if match_id == '132831' or match_id == '132877':
-            json_path = f"raw/tracking/{match_id}/{match_id}_metadata.json"
-            player_info = parse_json_for_player_info(json_path)
-        else:
-            xml_path = f"raw/tracking/{match_id}/{match_id}_tracker_box_metadata.xml"
-            player_info = parse_xml_for_player_info(xml_path)
-        
-        add_team_and_position_to_tracking(tracking_csv, player_info)
+def add_team_and_position_to_match(match_id):
+    """
+    Add team_id and position to the tracking CSV file of one match.
+
+    Args:
+        match_id (str): The match identifier.
+    """
+    tracking_csv = f"raw/tracking/{match_id}/{match_id}_pitch_plane_coordinates.csv"
+
+    if not Path(tracking_csv).exists():
+        logger.error(f"Tracking CSV file not found: {tracking_csv}")
+        return
+
+    if match_id == '132831' or match_id == '132877':
+        json_path = f"raw/tracking/{match_id}/{match_id}_metadata.json"
+        player_info = parse_json_for_player_info(json_path)
+    else:
+        xml_path = f"raw/tracking/{match_id}/{match_id}_tracker_box_metadata.xml"
+        player_info = parse_xml_for_player_info(xml_path)
+    
+    add_team_and_position_to_tracking(tracking_csv, player_info)
 
 
 def parse_xml_for_player_info(xml_path):
@@ -92,41 +110,69 @@ def parse_json_for_player_info(json_path):
     return player_info
 
 
-def add_team_and_position_to_tracking(tracking_csv, player_info):
+def add_team_and_position_to_tracking(tracking_csv, player_info, chunksize=CHUNK_SIZE):
     """
     Add team_id and position to the existing tracking CSV file.
 
+    The file is read in chunks and joined against player_info with categorical
+    codes, so no per-row Python lookups are made. All columns are read as text
+    and written back unchanged. The result is written to a temporary file that
+    replaces the original only once it is complete.
+
     Args:
         tracking_csv (str): Path to the tracking CSV file to be updated.
         player_info (dict): Mapping of player_id to team_id and position.
+        chunksize (int): Number of rows processed at a time.
     """
-    # 読み込みと書き込みのために一時的にメモリ上で操作
-    updated_rows = []
-    with open(tracking_csv, mode="r") as infile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames
-
-        # 新しい列を追加
-        if "team_id" not in fieldnames:
-            fieldnames.append("team_id")
-        if "position" not in fieldnames:
-            fieldnames.append("position")
-
-        for row in reader:
-            player_id = row["player_id"]
-            info = player_info.get(player_id, {"team_id": "UNKNOWN", "position": "UNKNOWN"})
-            row["team_id"] = info["team_id"]
-            row["position"] = info["position"]
-            updated_rows.append(row)
-
-    # 更新されたデータを同じファイルに上書き
-    with open(tracking_csv, mode="w", newline="") as outfile:
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(updated_rows)
+    player_index = pd.Index(list(player_info))
+    team_lookup, team_categories = build_lookup([info["team_id"] for info in player_info.values()])
+    position_lookup, position_categories = build_lookup([info["position"] for info in player_info.values()])
+
+    temp_csv = f"{tracking_csv}.tmp"
+    try:
+        with open(temp_csv, mode="w", newline="") as outfile:
+            reader = pd.read_csv(tracking_csv, dtype=str, keep_default_na=False, chunksize=chunksize)
+            header = True
+            for chunk in reader:
+                # Unknown player_ids get index -1, which selects the trailing "UNKNOWN" entry
+                codes = player_index.get_indexer(chunk["player_id"])
+                chunk["team_id"] = pd.Categorical.from_codes(team_lookup[codes], categories=team_categories)
+                chunk["position"] = pd.Categorical.from_codes(position_lookup[codes], categories=position_categories)
+                chunk.to_csv(outfile, header=header, index=False, lineterminator="\r\n")
+                header = False
+
+            if header:
+                # Header-only input: keep the header and add the new columns
+                columns = list(pd.read_csv(tracking_csv, nrows=0).columns)
+                columns += [column for column in ("team_id", "position") if column not in columns]
+                pd.DataFrame(columns=columns).to_csv(outfile, index=False, lineterminator="\r\n")
+        os.replace(temp_csv, tracking_csv)
+    finally:
+        if os.path.exists(temp_csv):
+            os.remove(temp_csv)
 
     logger.info(f"Tracking data in {tracking_csv} updated with team_id and position.")
 
 
+def build_lookup(values):
+    """
+    Build categorical codes for per-player values, with "UNKNOWN" for unknown players.
+
+    Args:
+        values (list): Value (team_id or position) of each player, in player_info order.
+
+    Returns:
+        tuple: (codes array with one entry per player plus a trailing "UNKNOWN" entry,
+            list of categories). Missing values get code -1.
+    """
+    categories = list(dict.fromkeys(value for value in values if value is not None))
+    if "UNKNOWN" not in categories:
+        categories.append("UNKNOWN")
+    index = {category: i for i, category in enumerate(categories)}
+    codes = [index[value] if value is not None else -1 for value in values]
+    codes.append(index["UNKNOWN"])
+    return np.array(codes, dtype=np.int64), categories
+
+
 if __name__ == "__main__":
     main()
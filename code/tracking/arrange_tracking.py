@@ -1,13 +1,23 @@
 import os
 import re
 import json
+import numpy as np
 import pandas as pd
 import argparse
 from pathlib import Path
+from task_pool import run_tasks, report_failures
+
+
+# Positions in the order players are numbered within a team
+POSITION_ORDER = ['GK', 'CB', 'RWB', 'RB', 'LWB', 'LB', 'CDM', 'RM', 'CM', 'LM', 'CAM', 'RW', 'LW', 'CF']
+# Player slots per team in the fixed-shape array output
+PLAYERS_PER_TEAM = 11
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('--match_id', required=True, help="Match ID to process")
+    parser.add_argument('--workers', type=int, default=1, help="Number of tracking files processed in parallel")
+    parser.add_argument('--save_npz', action='store_true', help="Also save a fixed-shape (frames, 23, 2) float32 array next to each CSV")
     return parser.parse_args()
 
 
@@ -20,16 +30,19 @@ def main():
     with open(json_file, 'r') as f:
         json_data = json.load(f)
 
+    tasks = []
     for match_id in match_ids:
         csv_dir = Path(f'raw/tracking/{match_id}')
         output_dir = Path(f'interim/{match_id}')
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        for csv_file in csv_dir.glob("*tracking.csv"):
-            process_tracking_data(csv_file, json_data, output_dir)
+        for csv_file in sorted(csv_dir.glob("*tracking.csv")):
+            tasks.append((csv_file.name, (csv_file, json_data, output_dir, args.save_npz)))
 
+    report_failures(run_tasks(process_tracking_data, tasks, args.workers))
 
-def process_tracking_data(csv_file, json_data, output_dir):
+
+def process_tracking_data(csv_file, json_data, output_dir, save_npz=False):
     game_id, start_time, end_time = parse_time_range(Path(csv_file).stem)
     half = determine_half(start_time)
     if half is None:
@@ -47,72 +60,136 @@ def process_tracking_data(csv_file, json_data, output_dir):
     # Load CSV data
     df = pd.read_csv(csv_file)
 
-    # Define positions in the desired order
-    position_order = ['GK', 'CB', 'RWB', 'RB', 'LWB', 'LB', 'CDM', 'RM', 'CM', 'LM', 'CAM', 'RW', 'LW', 'CF']
-
-    # Create empty lists for rows
-    rows = []
-
-    # Group by match time
-    for match_time, group in df.groupby('match_time'):
-        row = {'match_time': match_time, 'ball_x': None, 'ball_y': None}
-
-        left_players = group[group['team_id'] == left_team_id]
-        right_players = group[group['team_id'] == right_team_id]
-
-        # Add ball data
-        ball_data = group[group['player_id'] == 'ball']
-        if not ball_data.empty:
-            row['ball_x'] = ball_data.iloc[0]['x']
-            row['ball_y'] = ball_data.iloc[0]['y']
-
-        # Process left team
-        num_left_team_player = 1
-        for position in position_order:
-            position_players = left_players[left_players['position'] == position]
-            if not position_players.empty:
-                if len(position_players) == 1:
-                    row[f'left_{num_left_team_player}_x'] = position_players.iloc[0]['x']
-                    row[f'left_{num_left_team_player}_y'] = position_players.iloc[0]['y']
-                    num_left_team_player += 1
-                else:
-                    position_players = position_players.reset_index(drop=True)
-                    for i in range(len(position_players)):
-                        player_x = position_players.loc[i, 'x']
-                        player_y = position_players.loc[i, 'y']
-                        row[f'left_{num_left_team_player}_x'] = player_x
-                        row[f'left_{num_left_team_player}_y'] = player_y
-                        num_left_team_player += 1
-
-        # Process right team
-        num_right_team_player = 1
-        for position in position_order:
-            position_players = right_players[right_players['position'] == position]
-            if not position_players.empty:
-                if len(position_players) == 1:
-                    row[f'right_{num_right_team_player}_x'] = position_players.iloc[0]['x']
-                    row[f'right_{num_right_team_player}_y'] = position_players.iloc[0]['y']
-                    num_right_team_player += 1
-                else:
-                    position_players = position_players.reset_index(drop=True)
-                    for i in range(len(position_players)):
-                        player_x = position_players.loc[i, 'x']
-                        player_y = position_players.loc[i, 'y']
-                        row[f'right_{num_right_team_player}_x'] = player_x
-                        row[f'right_{num_right_team_player}_y'] = player_y
-                        num_right_team_player += 1
-
-        # print(row)
-        rows.append(row)
-
-    # Convert rows to DataFrame
-    output_df = pd.DataFrame(rows)
+    # Pivot all frames into one row per match time
+    output_df = arrange_frames(df, left_team_id, right_team_id)
 
     # Save to CSV
     output_file = Path(output_dir) / f"{os.path.splitext(Path(csv_file).stem)[0]}_arranged.csv"
     output_df.to_csv(output_file, index=False)
     print(f"Processed file saved to {output_file}")
 
+    if save_npz:
+        npz_file = output_file.with_suffix('.npz')
+        np.savez(npz_file, **frames_to_tensor(output_df))
+        print(f"Processed array saved to {npz_file}")
+
+
+def arrange_frames(df, left_team_id, right_team_id):
+    """
+    Pivot long-format tracking rows into one wide row per match time.
+
+    Each row holds match_time, ball_x/ball_y, then left_k_x/left_k_y and
+    right_k_x/right_k_y. Within a frame, a team's players are numbered in
+    POSITION_ORDER and, for players sharing a position, in file order. Players
+    whose position is not in POSITION_ORDER are left out. The slots of all frames
+    are computed with one sort per team and filled with array assignments.
+    Columns are ordered by the first frame they appear in, as when building the
+    frame from per-frame dicts.
+
+    Args:
+        df (DataFrame): Tracking rows with match_time, player_id, x, y, team_id and position.
+        left_team_id (str): Team attacking from the left in this half.
+        right_team_id (str): Team attacking from the right in this half.
+
+    Returns:
+        DataFrame: The wide per-frame table.
+    """
+    # Frame index of every row (-1 where match_time is missing)
+    frame_codes, match_times = pd.factorize(df['match_time'], sort=True)
+    num_frames = len(match_times)
+    if num_frames == 0:
+        return pd.DataFrame([])
+
+    x = df['x'].to_numpy()
+    y = df['y'].to_numpy()
+    has_frame = frame_codes >= 0
+
+    # Ball: first ball row of each frame
+    ball_rows = np.flatnonzero((df['player_id'] == 'ball').to_numpy() & has_frame)
+    ball_frames, first = np.unique(frame_codes[ball_rows], return_index=True)
+    ball_x = np.full(num_frames, np.nan)
+    ball_y = np.full(num_frames, np.nan)
+    ball_x[ball_frames] = x[ball_rows[first]]
+    ball_y[ball_frames] = y[ball_rows[first]]
+
+    # Sort keys: (first frame the column appears in, place of the column within a row)
+    columns = {'match_time': match_times.to_numpy(), 'ball_x': ball_x, 'ball_y': ball_y}
+    column_keys = {'match_time': (0, 0, 0, 0), 'ball_x': (0, 0, 0, 1), 'ball_y': (0, 0, 0, 2)}
+
+    position_rank = df['position'].map({position: i for i, position in enumerate(POSITION_ORDER)}).to_numpy(dtype=float)
+    for side_index, (side, team_id) in enumerate((('left', left_team_id), ('right', right_team_id)), start=1):
+        rows = np.flatnonzero((df['team_id'] == team_id).to_numpy() & ~np.isnan(position_rank) & has_frame)
+        if len(rows) == 0:
+            continue
+
+        # Order the team's rows by frame, then position, then file order
+        rows = rows[np.lexsort((rows, position_rank[rows], frame_codes[rows]))]
+        frames = frame_codes[rows]
+
+        # Slot number of each row within its frame
+        run_starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+        run_lengths = np.diff(np.r_[run_starts, len(frames)])
+        slots = np.arange(len(frames)) - np.repeat(run_starts, run_lengths)
+
+        for slot in range(slots.max() + 1):
+            in_slot = slots == slot
+            slot_frames = frames[in_slot]
+            slot_x = np.full(num_frames, np.nan)
+            slot_y = np.full(num_frames, np.nan)
+            slot_x[slot_frames] = x[rows[in_slot]]
+            slot_y[slot_frames] = y[rows[in_slot]]
+
+            first_frame = slot_frames.min()
+            columns[f'{side}_{slot + 1}_x'] = slot_x
+            columns[f'{side}_{slot + 1}_y'] = slot_y
+            column_keys[f'{side}_{slot + 1}_x'] = (first_frame, side_index, slot, 0)
+            column_keys[f'{side}_{slot + 1}_y'] = (first_frame, side_index, slot, 1)
+
+    ordered = sorted(columns, key=column_keys.get)
+    return pd.DataFrame({name: columns[name] for name in ordered})
+
+
+def frames_to_tensor(output_df, players_per_team=PLAYERS_PER_TEAM):
+    """
+    Convert the wide per-frame table into fixed-shape arrays.
+
+    Objects are laid out as the ball, left_1..left_11, then right_1..right_11,
+    so the shape does not depend on which positions are present in a clip.
+    Missing objects are 0.0 with mask False. Slots beyond players_per_team are
+    dropped.
+
+    Args:
+        output_df (DataFrame): Table returned by arrange_frames.
+        players_per_team (int): Number of player slots per team.
+
+    Returns:
+        dict: 'positions' (frames, 1 + 2 * players_per_team, 2) float32,
+            'mask' (frames, 1 + 2 * players_per_team) bool, and 'match_time' (frames,) int64.
+    """
+    num_frames = len(output_df)
+    num_objects = 1 + 2 * players_per_team
+    positions = np.full((num_frames, num_objects, 2), np.nan, dtype=np.float32)
+
+    names = ['ball'] + [f'{side}_{k}' for side in ('left', 'right') for k in range(1, players_per_team + 1)]
+    for i, name in enumerate(names):
+        if f'{name}_x' in output_df:
+            positions[:, i, 0] = output_df[f'{name}_x'].to_numpy(dtype=np.float32)
+            positions[:, i, 1] = output_df[f'{name}_y'].to_numpy(dtype=np.float32)
+
+    dropped = [column for column in output_df.columns
+               if column.endswith('_x') and not column.startswith('ball') and column[:-2] not in names]
+    if dropped:
+        print(f"Dropped {len(dropped)} player slots beyond {players_per_team} per team from the array output.")
+
+    mask = ~np.isnan(positions).any(axis=2)
+    positions[~mask] = 0.0
+    if num_frames:
+        match_time = output_df['match_time'].to_numpy(dtype=np.int64)
+    else:
+        match_time = np.zeros(0, dtype=np.int64)
+
+    return {'positions': positions, 'mask': mask, 'match_time': match_time}
+
 
 def parse_time_range(filename):
     match = re.search(r"(\d+)_\d{2}_\d{2}-\d{2}_\d{2}", filename)
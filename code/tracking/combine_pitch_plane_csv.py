@@ -1,11 +1,20 @@
 import pandas as pd
 import glob
+import os
 import argparse
+from pathlib import Path
+from task_pool import run_tasks, report_failures
+
+
+# Number of rows read from each part file at a time
+CHUNK_SIZE = 500000
+SORT_KEYS = ["frame", "match_time"]
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument('--match_id')
+    parser.add_argument('--workers', type=int, default=1, help="Number of matches combined in parallel")
     return parser.parse_args()
 
 
@@ -13,39 +22,154 @@ def main():
     args = parse_arguments()
     match_ids = [str(match_id) for match_id in args.match_id.split(",")]
 
+    tasks = []
     for match_id in match_ids:
         # Specify the input folder and output file
         input_folder = f"raw/tracking/{match_id}"
         output_file = f"raw/tracking/{match_id}/{match_id}_pitch_plane_coordinates.csv"
+        tasks.append((match_id, (input_folder, output_file)))
 
-        # Combine the CSV files
-        combine_csv_files(input_folder, output_file)
+    # Combine the CSV files
+    report_failures(run_tasks(combine_csv_files, tasks, args.workers))
 
 
-def combine_csv_files(input_folder, output_file):
+def combine_csv_files(input_folder, output_file, chunksize=CHUNK_SIZE):
     """
     Combine all CSV files in a specified folder into one CSV file.
 
+    The part files are merged in a streaming fashion: each one is read in chunks
+    of chunksize rows, and rows are written ordered by (frame, match_time), so
+    memory is bounded by the chunk size rather than by the length of the match.
+    Each part is expected to be ordered by (frame, match_time) already, as written
+    by convert_raw_to_pitch_plane_csv.py. The output file itself is never used as
+    an input, so the stage can be re-run safely.
+
     Args:
         input_folder (str): Path to the folder containing input CSV files.
         output_file (str): Path to save the combined CSV file.
+        chunksize (int): Number of rows read from each part file at a time.
 
     Returns:
         None
     """
-    # Get a list of all CSV files in the folder
-    csv_files = glob.glob(f"{input_folder}/*pitch_plane_coordinates.csv")
+    # Get a list of all CSV files in the folder, leaving out the output file
+    output_path = Path(output_file).resolve()
+    csv_files = sorted(
+        file for file in glob.glob(f"{input_folder}/*pitch_plane_coordinates.csv")
+        if Path(file).resolve() != output_path
+    )
     if not csv_files:
         print("No CSV files found in the specified folder.")
         return
 
-    # Read and combine all CSV files
-    combined_df = pd.concat([pd.read_csv(file) for file in csv_files], ignore_index=True)
+    readers = [pd.read_csv(file, chunksize=chunksize) for file in csv_files]
+    columns = pd.read_csv(csv_files[0], nrows=0).columns
+
+    # Write to a temporary file first so an interrupted run never leaves a partial CSV
+    temp_file = f"{output_file}.tmp"
+    try:
+        with open(temp_file, "w", newline="") as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            for merged in merge_sorted_chunks(readers, csv_files, columns):
+                merged.to_csv(f, header=False, index=False)
+        os.replace(temp_file, output_file)
+    finally:
+        for reader in readers:
+            reader.close()
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
 
-    # Save the combined data to a new CSV file
-    combined_df.to_csv(output_file, index=False)
     print(f"Combined CSV saved to {output_file}")
 
 
+def merge_sorted_chunks(readers, names, columns):
+    """
+    Merge chunked readers of (frame, match_time)-ordered files into ordered chunks.
+
+    At each step, every buffered row whose key is not larger than the smallest
+    "last key" among the buffers is safe to emit: no file can still produce a
+    smaller key. Those rows are sorted stably, so rows with equal keys keep file
+    order, and yielded; exhausted buffers are refilled from their file.
+
+    Args:
+        readers (list of iterator): Iterators of DataFrame chunks, one per file.
+        names (list of str): File names, used in warnings.
+        columns (Index): Output columns, in order.
+
+    Yields:
+        DataFrame: Consecutive blocks of the merged output.
+    """
+    sources = [iter_key_groups(reader, name) for reader, name in zip(readers, names)]
+    buffers = [next(source, None) for source in sources]
+
+    while True:
+        active = [i for i, buffer in enumerate(buffers) if buffer is not None]
+        if not active:
+            return
+
+        # Smallest last key among the buffered chunks
+        watermark = min(tuple(buffers[i].iloc[-1][SORT_KEYS]) for i in active)
+
+        parts = []
+        for i in active:
+            buffer = buffers[i]
+            ready = key_at_most(buffer, watermark)
+            parts.append(buffer[ready])
+            rest = buffer[~ready]
+            buffers[i] = rest if not rest.empty else next(sources[i], None)
+
+        merged = pd.concat(parts, ignore_index=True)
+        yield merged.sort_values(SORT_KEYS, kind="stable").reindex(columns=columns)
+
+
+def iter_key_groups(reader, name):
+    """
+    Yield sorted chunks of a reader that never split rows sharing a (frame, match_time) key.
+
+    Rows carrying the last key of a chunk are held back and prepended to the next
+    chunk, so every key is emitted from a single buffer during the merge.
+
+    Args:
+        reader (iterator): Iterator of DataFrame chunks of one file.
+        name (str): File name, used in warnings.
+
+    Yields:
+        DataFrame: Non-empty chunks sorted by (frame, match_time).
+    """
+    carry = None
+    last_key = None
+
+    for chunk in reader:
+        if chunk.empty:
+            continue
+        if last_key is not None and tuple(chunk.iloc[0][SORT_KEYS]) < last_key:
+            print(f"Warning: {name} is not ordered by frame and match_time; output order may be off.")
+        last_key = tuple(chunk.iloc[-1][SORT_KEYS])
+
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        chunk = chunk.sort_values(SORT_KEYS, kind="stable")
+
+        tail = ~key_at_most(chunk, tuple(chunk.iloc[-1][SORT_KEYS]), strict=True)
+        carry = chunk[tail]
+        if tail.all():
+            continue
+        yield chunk[~tail]
+
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def key_at_most(df, key, strict=False):
+    """
+    Return a boolean mask of the rows whose (frame, match_time) is <= key (< key if strict).
+    """
+    frame = df["frame"].to_numpy()
+    match_time = df["match_time"].to_numpy()
+    if strict:
+        return (frame < key[0]) | ((frame == key[0]) & (match_time < key[1]))
+    return (frame < key[0]) | ((frame == key[0]) & (match_time <= key[1]))
+
+
 if __name__ == "__main__":
     main()
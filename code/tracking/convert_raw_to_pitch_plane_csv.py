@@ -9,14 +9,36 @@ Example:
 
 Arguments:
     --match_id: The match identifier to process.
+    --binary: Also save the columns to {match_id}_pitch_plane_coordinates.npz (streamed, like the CSV).
+    --xml_workers: Number of processes used to parse the XML file (default: 1).
+    --workers: Number of matches (and JSON parts) converted in parallel (default: 1).
 """
 
 import argparse
-import csv
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from loguru import logger
 import json
+import io
+import os
+import re
+import shutil
+import tempfile
+import itertools
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from task_pool import run_tasks, report_failures
+
+
+FIELDNAMES = ["frame", "match_time", "player_id", "x", "y"]
+COLUMN_DTYPES = {"frame": np.int64, "match_time": np.int64, "player_id": object, "x": np.float64, "y": np.float64}
+# Number of rows collected before a chunk is handed to the writer
+CHUNK_SIZE = 200000
+XML_DECLARATION = re.compile(rb"\s*<\?xml[^>]*\?>")
+FRAME_TAG = re.compile(rb"<frame[\s/>]")
 
 
 def main():
@@ -25,22 +47,53 @@ def main():
     """
     parser = argparse.ArgumentParser(description="Convert raw XML tracking data to MOT-style CSV using match_id.")
     parser.add_argument("--match_id", required=True, type=str, help="The match identifier to process.")
+    parser.add_argument("--binary", action="store_true", help="Also save the columns to a .npz file next to each CSV.")
+    parser.add_argument("--xml_workers", type=int, default=1, help="Number of processes used to parse each XML file.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of matches (and JSON parts) converted in parallel.")
     args = parser.parse_args()
     match_ids = [str(match_id) for match_id in args.match_id.split(",")]
 
+    tasks = []
     for match_id in match_ids:
-        output_csv = f"raw/tracking/{match_id}/{match_id}_pitch_plane_coordinates.csv"
-
         if match_id == '132831' or match_id == '132877':
             for i in range(1, 4):
-                input_json = f"raw/tracking/{match_id}/{match_id}_{i}_frame_data.json"
-                output_csv = f"raw/tracking/{match_id}/{match_id}_{i}_pitch_plane_coordinates.csv"
-                tracking_data = parse_json(input_json)
-                write_csv(tracking_data, output_csv)
+                tasks.append((f"{match_id}_{i}", (match_id, i, args.binary, args.xml_workers)))
+        else:
+            tasks.append((match_id, (match_id, None, args.binary, args.xml_workers)))
+
+    report_failures(run_tasks(convert_match, tasks, args.workers))
+
+
+def convert_match(match_id, part=None, binary=False, xml_workers=1):
+    """
+    Convert the raw tracking data of one match, or one JSON part of a match.
+
+    Args:
+        match_id (str): The match identifier.
+        part (int, optional): Part number (1, 2 or 3) of a match split into JSON files.
+        binary (bool): Also save the columns to a .npz file next to the CSV.
+        xml_workers (int): Number of processes used to parse the XML file.
+    """
+    if part is not None:
+        input_json = f"raw/tracking/{match_id}/{match_id}_{part}_frame_data.json"
+        output_csv = f"raw/tracking/{match_id}/{match_id}_{part}_pitch_plane_coordinates.csv"
+        tracking_data = iterparse_json(input_json)
+    else:
+        input_xml = f"raw/tracking/{match_id}/{match_id}_tracker_box_data.xml"
+        output_csv = f"raw/tracking/{match_id}/{match_id}_pitch_plane_coordinates.csv"
+        if xml_workers > 1:
+            tracking_data = parse_xml_parallel(input_xml, xml_workers)
         else:
-            input_xml = f"raw/tracking/{match_id}/{match_id}_tracker_box_data.xml"
-            tracking_data = parse_xml(input_xml)
-            write_csv(tracking_data, output_csv)
+            tracking_data = iterparse_xml(input_xml)
+
+    write_csv(tracking_data, output_csv, npz_path(output_csv) if binary else None)
+
+
+def npz_path(output_csv):
+    """
+    Return the path of the binary columnar file written next to a CSV file.
+    """
+    return str(Path(output_csv).with_suffix(".npz"))
 
 
 def parse_xml(xml_path):
@@ -51,33 +104,195 @@ def parse_xml(xml_path):
         xml_path (str): Path to the XML file.
 
     Returns:
-        list of dict: A list containing tracking information for each player in each frame.
-    """
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-    tracking_data = []
-
-    for frame in root.findall("frame"):
-        frame_number = int(frame.get("frameNumber"))
-        match_time = int(frame.get("matchTime"))
-        
-        for player in frame:
-            player_id = player.get("playerId")
-            loc = player.get("loc")
-            # Convert loc string to float coordinates
-            try:
-                x, y = map(float, loc.strip("[]").split(","))
-                tracking_data.append({
-                    "frame": frame_number,
-                    "match_time": match_time,
-                    "player_id": player_id,
-                    "x": "{:.2f}".format(x * 105 - 52.5),
-                    "y": "{:.2f}".format(y * 68 - 34.0)
-                })
-            except ValueError:
-                logger.warning(f"Invalid location format for player {player_id} in frame {frame_number}")
+        dict of numpy.ndarray: Column arrays (frame, match_time, player_id, x, y)
+            with one entry per player per frame.
+    """
+    return concat_columns(iterparse_xml(xml_path))
+
+
+def iterparse_xml(xml_path, chunk_size=CHUNK_SIZE):
+    """
+    Stream the XML file frame by frame and yield tracking data in column chunks.
 
-    return tracking_data
+    Each <frame> element is cleared as soon as its players have been read, so
+    memory usage does not grow with the length of the match.
+
+    Args:
+        xml_path (str or file object): Path to the XML file.
+        chunk_size (int): Approximate number of rows per yielded chunk.
+
+    Yields:
+        dict of numpy.ndarray: Column arrays for a block of consecutive frames.
+    """
+    context = ET.iterparse(xml_path, events=("start", "end"))
+    _, root = next(context)
+    depth = 1
+    columns = new_columns()
+
+    for event, frame in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        # Only direct children of the root are frames, as with root.findall("frame")
+        if depth != 1 or frame.tag != "frame":
+            continue
+
+        append_xml_frame(frame, columns)
+        # Drop the finished frame (and any siblings already read) from the tree
+        root.clear()
+
+        if len(columns["frame"]) >= chunk_size:
+            yield columns_to_arrays(columns)
+            columns = new_columns()
+
+    if columns["frame"]:
+        yield columns_to_arrays(columns)
+
+
+def append_xml_frame(frame, columns):
+    """
+    Append the players of one <frame> element to the column lists.
+
+    Args:
+        frame (xml.etree.ElementTree.Element): The <frame> element.
+        columns (dict of list): Column lists to append to.
+    """
+    frame_number = int(frame.get("frameNumber"))
+    match_time = int(frame.get("matchTime"))
+    frames, match_times, player_ids, xs, ys = (columns[name] for name in FIELDNAMES)
+
+    for player in frame:
+        player_id = player.get("playerId")
+        loc = player.get("loc")
+        # Convert loc string to float coordinates
+        try:
+            x, y = map(float, loc.strip("[]").split(","))
+        except ValueError:
+            logger.warning(f"Invalid location format for player {player_id} in frame {frame_number}")
+            continue
+        frames.append(frame_number)
+        match_times.append(match_time)
+        player_ids.append(player_id)
+        xs.append(x * 105 - 52.5)
+        ys.append(y * 68 - 34.0)
+
+
+def parse_xml_parallel(xml_path, workers, chunk_bytes=64 << 20):
+    """
+    Parse the XML file in a process pool and yield tracking data in frame order.
+
+    The file is split into byte ranges on <frame> boundaries, each range is parsed
+    by a worker, and the resulting column chunks are yielded in file order, so the
+    output is identical to iterparse_xml.
+
+    Args:
+        xml_path (str): Path to the XML file.
+        workers (int): Number of worker processes.
+        chunk_bytes (int): Approximate size of each byte range.
+
+    Yields:
+        dict of numpy.ndarray: Column arrays for each byte range, in file order.
+    """
+    declaration, ranges = split_xml_frames(xml_path, chunk_bytes)
+    logger.info(f"Parsing {xml_path} in {len(ranges)} chunks with {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep only a bounded number of parsed chunks in flight
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(parse_xml_range, xml_path, start, end, declaration))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def split_xml_frames(xml_path, chunk_bytes):
+    """
+    Split the body of the XML file into byte ranges that start on a <frame> tag.
+
+    Args:
+        xml_path (str): Path to the XML file.
+        chunk_bytes (int): Approximate size of each byte range.
+
+    Returns:
+        tuple: (XML declaration bytes, list of (start, end) byte offsets).
+    """
+    file_size = Path(xml_path).stat().st_size
+
+    with open(xml_path, "rb") as f:
+        head = f.read(min(file_size, 1 << 20))
+        match = XML_DECLARATION.match(head)
+        declaration = match.group(0) if match else b""
+
+        body_start = find_frame_tag(f, 0)
+        if body_start is None:
+            return declaration, []
+
+        # The body ends where the closing tag of the root element begins
+        tail_start = max(body_start, file_size - (1 << 16))
+        f.seek(tail_start)
+        body_end = tail_start + f.read().rfind(b"</")
+
+        boundaries = [body_start]
+        target = body_start + chunk_bytes
+        while target < body_end:
+            boundary = find_frame_tag(f, target)
+            if boundary is None or boundary >= body_end:
+                break
+            boundaries.append(boundary)
+            target = boundary + chunk_bytes
+        boundaries.append(body_end)
+
+    return declaration, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def find_frame_tag(f, offset, block_size=1 << 16):
+    """
+    Return the byte offset of the first <frame> start tag at or after offset.
+
+    Args:
+        f (file object): XML file opened in binary mode.
+        offset (int): Byte offset to start searching from.
+        block_size (int): Number of bytes to read at a time.
+
+    Returns:
+        int or None: Offset of the tag, or None if there is none.
+    """
+    f.seek(offset)
+    carry = b""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return None
+        data = carry + block
+        match = FRAME_TAG.search(data)
+        if match:
+            return offset - len(carry) + match.start()
+        # Keep enough bytes to catch a tag split across blocks
+        carry = data[-16:]
+        offset += len(block)
+
+
+def parse_xml_range(xml_path, start, end, declaration=b""):
+    """
+    Parse the <frame> elements in one byte range of the XML file.
+
+    Args:
+        xml_path (str): Path to the XML file.
+        start (int): Byte offset of the first <frame> tag in the range.
+        end (int): Byte offset just past the last frame in the range.
+        declaration (bytes): XML declaration of the file, so the encoding is kept.
+
+    Returns:
+        dict of numpy.ndarray: Column arrays for the frames in the range.
+    """
+    with open(xml_path, "rb") as f:
+        f.seek(start)
+        body = f.read(end - start)
+    document = io.BytesIO(declaration + b"<frames>" + body + b"</frames>")
+    return concat_columns(iterparse_xml(document))
 
 
 def parse_json(json_path):
@@ -88,44 +303,291 @@ def parse_json(json_path):
         json_path (str): Path to the JSON file.
 
     Returns:
-        list of dict: A list containing tracking information for each player in each frame.
+        dict of numpy.ndarray: Column arrays (frame, match_time, player_id, x, y)
+            with one entry per player per frame.
+    """
+    return concat_columns(iterparse_json(json_path))
+
+
+def iterparse_json(json_path, chunk_size=CHUNK_SIZE, read_size=1 << 20):
+    """
+    Stream the JSON file frame by frame and yield tracking data in column chunks.
+
+    The file is read in blocks and only one frame's player list is decoded at a
+    time, so the first rows are produced before the whole file has been read.
+
+    Args:
+        json_path (str): Path to the JSON file.
+        chunk_size (int): Approximate number of rows per yielded chunk.
+        read_size (int): Number of characters to read from the file at a time.
+
+    Yields:
+        dict of numpy.ndarray: Column arrays for a block of consecutive frames.
     """
+    columns = new_columns()
+    frames, match_times, player_ids, xs, ys = (columns[name] for name in FIELDNAMES)
+
     with open(json_path, "r") as f:
-        data = json.load(f)
+        for frame_number, players in iter_json_object_items(f, read_size):
+            for player in players:
+                try:
+                    row = (
+                        int(frame_number),
+                        int(player.get("match_time", 0)),
+                        "ball" if player.get("player_id") == None else player.get("player_id"),
+                        float(player.get("x", 0) - 52.5),
+                        float(player.get("y", 0) - 34.0)
+                    )
+                except ValueError:
+                    logger.warning(f"Invalid data format in frame {frame_number}")
+                    continue
+                frames.append(row[0])
+                match_times.append(row[1])
+                player_ids.append(row[2])
+                xs.append(row[3])
+                ys.append(row[4])
+
+            if len(frames) >= chunk_size:
+                yield columns_to_arrays(columns)
+                columns = new_columns()
+                frames, match_times, player_ids, xs, ys = (columns[name] for name in FIELDNAMES)
+
+    if frames:
+        yield columns_to_arrays(columns)
 
-    tracking_data = []
-    for frame_number, players in data.items():
-        for player in players:
+
+def iter_json_object_items(f, read_size=1 << 20):
+    """
+    Incrementally decode a top-level JSON object and yield its items in file order.
+
+    Args:
+        f (file object): Text file positioned at the start of the JSON document.
+        read_size (int): Number of characters to read from the file at a time.
+
+    Yields:
+        tuple: (key, value) for each member of the top-level object.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def skip_whitespace(pos):
+        while pos < len(buffer) and buffer[pos] in " \t\r\n":
+            pos += 1
+        return pos
+
+    def decode(pos):
+        # Decode one value starting at pos, reading more of the file until it is complete
+        nonlocal buffer, eof
+        while True:
+            pos = skip_whitespace(pos)
             try:
-                tracking_data.append({
-                    "frame": int(frame_number),
-                    "match_time": int(player.get("match_time", 0)),
-                    "player_id": "ball" if player.get("player_id") == None else player.get("player_id"),
-                    "x": "{:.2f}".format(float(player.get("x", 0) - 52.5)),
-                    "y": "{:.2f}".format(float(player.get("y", 0) - 34.0))
-                })
-            except ValueError:
-                logger.warning(f"Invalid data format in frame {frame_number}")
-    
-    return tracking_data
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof:
+                    return value, end
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            buffer = buffer[pos:]
+            pos = 0
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer += chunk
+
+    def expect(pos, chars):
+        # Return the next non-whitespace character (one of chars) and the position after it
+        nonlocal buffer, eof
+        while True:
+            pos = skip_whitespace(pos)
+            if pos < len(buffer):
+                if buffer[pos] not in chars:
+                    raise json.JSONDecodeError(f"Expecting one of {chars!r}", buffer, pos)
+                return buffer[pos], pos + 1
+            if eof:
+                raise json.JSONDecodeError("Unexpected end of data", buffer, pos)
+            buffer = ""
+            pos = 0
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = chunk
+
+    _, pos = expect(pos, "{")
+    char, next_pos = expect(pos, '}"')
+    if char == "}":
+        return
+    while True:
+        key, pos = decode(next_pos - 1)
+        _, pos = expect(pos, ":")
+        value, pos = decode(pos)
+        yield key, value
+        char, pos = expect(pos, ",}")
+        if char == "}":
+            return
+        _, next_pos = expect(pos, '"')
+
+
+def new_columns():
+    """
+    Create empty column lists for tracking rows.
+
+    Returns:
+        dict of list: One empty list per output column.
+    """
+    return {name: [] for name in FIELDNAMES}
+
+
+def columns_to_arrays(columns):
+    """
+    Convert column lists to typed numpy arrays.
+
+    Args:
+        columns (dict of list): Column lists as filled by the parsers.
+
+    Returns:
+        dict of numpy.ndarray: Column arrays keyed by column name.
+    """
+    return {name: np.asarray(columns[name], dtype=COLUMN_DTYPES[name]) for name in FIELDNAMES}
+
+
+def concat_columns(chunks):
+    """
+    Concatenate column chunks into a single set of column arrays.
+
+    Args:
+        chunks (iterable of dict): Column chunks as yielded by the parsers.
+
+    Returns:
+        dict of numpy.ndarray: Column arrays keyed by column name.
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return columns_to_arrays(new_columns())
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in FIELDNAMES}
 
 
-def write_csv(tracking_data, output_csv):
+def write_csv(tracking_data, output_csv, output_npz=None):
     """
     Write the tracking data to a CSV file in MOT-style format.
 
+    Each chunk is formatted and written in bulk, with x and y rounded to two
+    decimals. Chunks are written as they are produced, so a generator is
+    consumed without being stored.
+
     Args:
-        tracking_data (list of dict): Tracking information.
+        tracking_data (iterable of dict): Column chunks as yielded by the parsers.
         output_csv (str): Path to the output CSV file.
+        output_npz (str, optional): If given, also save the columns, with x and y
+            at full precision, to this binary .npz file (see NpzColumnWriter).
     """
-    fieldnames = ["frame", "match_time", "player_id", "x", "y"]
-    with open(output_csv, mode="w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for data in tracking_data:
-            writer.writerow(data)
+    npz_writer = NpzColumnWriter(output_npz) if output_npz is not None else None
+    # Write to a temporary file first so a failed parse never leaves a partial CSV
+    temp_csv = f"{output_csv}.tmp"
+    try:
+        with open(temp_csv, mode="w", newline="") as csvfile:
+            csvfile.write(",".join(FIELDNAMES) + "\r\n")
+            for chunk in tracking_data:
+                pd.DataFrame(chunk, columns=FIELDNAMES).to_csv(
+                    csvfile, header=False, index=False, float_format="%.2f", lineterminator="\r\n"
+                )
+                if npz_writer is not None:
+                    npz_writer.append(chunk)
+        os.replace(temp_csv, output_csv)
+        logger.info(f"Tracking data written to {output_csv}")
+
+        if npz_writer is not None:
+            npz_writer.close()
+            logger.info(f"Tracking data written to {output_npz}")
+    finally:
+        if os.path.exists(temp_csv):
+            os.remove(temp_csv)
+        if npz_writer is not None:
+            npz_writer.discard()
+
+
+class NpzColumnWriter:
+    """
+    Write column chunks to a .npz file without holding the whole match in memory.
+
+    Each chunk is appended to a temporary file per column: the raw bytes of the
+    numeric columns, and one line per player_id. close() streams these files into
+    the .npz as one .npy entry per column, in blocks of CHUNK_SIZE rows, so the
+    result is the same as np.savez on the concatenated columns. player_id is
+    stored as fixed-width strings, None as "".
+    """
+
+    NUMERIC_COLUMNS = ["frame", "match_time", "x", "y"]
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.temp_dir = tempfile.mkdtemp(prefix=".npz_columns_", dir=Path(self.path).parent)
+        self.files = {name: open(os.path.join(self.temp_dir, name), "wb") for name in self.NUMERIC_COLUMNS}
+        self.player_id_file = open(os.path.join(self.temp_dir, "player_id"), "w", encoding="utf-8", newline="\n")
+        self.player_id_width = 0
+        self.rows = 0
+
+    def append(self, chunk):
+        """
+        Append a column chunk as yielded by the parsers.
+        """
+        for name in self.NUMERIC_COLUMNS:
+            self.files[name].write(np.ascontiguousarray(chunk[name], dtype=COLUMN_DTYPES[name]).tobytes())
+        player_ids = ["" if player_id is None else str(player_id) for player_id in chunk["player_id"]]
+        if player_ids:
+            self.player_id_file.write("\n".join(player_ids) + "\n")
+            self.player_id_width = max(self.player_id_width, max(map(len, player_ids)))
+        self.rows += len(player_ids)
+
+    def close(self):
+        """
+        Write the .npz file from the column files and remove them.
+        """
+        for f in [*self.files.values(), self.player_id_file]:
+            f.close()
+
+        temp_npz = f"{self.path}.tmp"
+        with zipfile.ZipFile(temp_npz, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name in FIELDNAMES:
+                with archive.open(f"{name}.npy", mode="w", force_zip64=True) as entry:
+                    if name == "player_id":
+                        self._write_player_ids(entry)
+                    else:
+                        self._write_numeric(entry, name)
+        os.replace(temp_npz, self.path)
+        self.discard()
+
+    def discard(self):
+        """
+        Remove the temporary files if the writer was not closed.
+        """
+        if self.temp_dir is None:
+            return
+        for f in [*self.files.values(), self.player_id_file]:
+            f.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.temp_dir = None
+        if os.path.exists(f"{self.path}.tmp"):
+            os.remove(f"{self.path}.tmp")
+
+    def _write_numeric(self, entry, name):
+        dtype = np.dtype(COLUMN_DTYPES[name])
+        np.lib.format.write_array_header_1_0(entry, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (self.rows,)})
+        with open(os.path.join(self.temp_dir, name), "rb") as f:
+            shutil.copyfileobj(f, entry, CHUNK_SIZE * dtype.itemsize)
 
-    logger.info(f"Tracking data written to {output_csv}")
+    def _write_player_ids(self, entry):
+        # np.array of an empty list is float64, as with np.savez before
+        dtype = np.dtype(f"<U{max(self.player_id_width, 1)}") if self.rows > 0 else np.dtype(np.float64)
+        np.lib.format.write_array_header_1_0(entry, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (self.rows,)})
+        with open(os.path.join(self.temp_dir, "player_id"), "r", encoding="utf-8", newline="\n") as f:
+            while True:
+                lines = [line[:-1] for line in itertools.islice(f, CHUNK_SIZE)]
+                if not lines:
+                    break
+                entry.write(np.array(lines, dtype=dtype).tobytes())
 
 
 if __name__ == "__main__":
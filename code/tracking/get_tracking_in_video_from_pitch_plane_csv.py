@@ -1,6 +1,7 @@
 import xml.etree.ElementTree as ET
 import re
 import os
+import numpy as np
 import pandas as pd
 import argparse
 
@@ -15,6 +16,9 @@ def main():
     args = parse_arguments()
     video_ids = [str(video_id) for video_id in args.video_id.split(",")]
 
+    # 直前に読み込んだ試合のトラッキングデータを次のvideo_idでも使い回す
+    tracking_cache = {}
+
     for video_id in video_ids:
         # トラッキングデータのcsvファイルがあるディレクトリ
         csv_file_dir = 'raw/tracking'
@@ -25,10 +29,27 @@ def main():
         # 抽出したトラッキングデータが入るディレクトリ
         output_file_dir = 'raw/tracking'
 
-        get_tracking_in_video(csv_file_dir, txt_file, output_file_dir)
+        get_tracking_in_video(csv_file_dir, txt_file, output_file_dir, tracking_cache)
+
+
+def get_tracking_in_video(csv_file_dir, txt_file, output_file_dir, tracking_cache=None):
+    """
+    Extract the tracking data of each video in the list into its own CSV file.
+
+    Clips are processed grouped by game. Each game's tracking file is loaded once,
+    sorted by match_time, and every clip is cut with binary-search offsets instead
+    of a boolean mask over all rows. Only the current game is kept in memory.
 
+    Args:
+        csv_file_dir (str): Directory of the {game_id}/{game_id}_pitch_plane_coordinates.csv files.
+        txt_file (str): Path to the video list file.
+        output_file_dir (str): Directory of the {game_id}/{video}_tracking.csv outputs.
+        tracking_cache (dict, optional): Tracking data of the last loaded game keyed by input path,
+            shared between calls so a game spanning consecutive lists is not read again.
+    """
+    if tracking_cache is None:
+        tracking_cache = {}
 
-def get_tracking_in_video(csv_file_dir, txt_file, output_file_dir):
     with open(txt_file, "r") as f:
         # 拡張子を省いたファイル名を取得
         video_files = [os.path.splitext(line.strip())[0] for line in f.readlines()]
@@ -40,8 +61,8 @@ def get_tracking_in_video(csv_file_dir, txt_file, output_file_dir):
         if start_time is not None and end_time is not None:
             videos[video_file] = (game_id, start_time * 1000, end_time * 1000)  # ミリ秒に変換
 
-    # トラッキングデータを取得
-    for video_file, (game_id, start_time, end_time) in videos.items():
+    # トラッキングデータを取得 (試合ごとにまとめて処理)
+    for video_file, (game_id, start_time, end_time) in sorted(videos.items(), key=lambda item: item[1][0]):
         input_csv = os.path.join(csv_file_dir, f"{game_id}/{game_id}_pitch_plane_coordinates.csv")
         output_csv = os.path.join(output_file_dir, f"{game_id}/{video_file}_tracking.csv")
 
@@ -49,16 +70,39 @@ def get_tracking_in_video(csv_file_dir, txt_file, output_file_dir):
             print(f"Tracking data file not found: {input_csv}")
             continue
 
-        # トラッキングデータをフィルタリングして保存
-        tracking_data = pd.read_csv(input_csv)
-        filtered_data = tracking_data[
-            (tracking_data["match_time"] >= start_time) &
-            (tracking_data["match_time"] <= end_time)
-        ]
-        filtered_data.to_csv(output_csv, index=False)
+        if input_csv not in tracking_cache:
+            # 前の試合のデータを解放してから読み込む
+            tracking_cache.clear()
+            tracking_cache[input_csv] = load_game_tracking(input_csv)
+        tracking_data, match_time = tracking_cache[input_csv]
+
+        # トラッキングデータを二分探索で切り出して保存
+        start = np.searchsorted(match_time, start_time, side="left")
+        end = np.searchsorted(match_time, end_time, side="right")
+        tracking_data.iloc[start:end].to_csv(output_csv, index=False)
         print(f"Extracted tracking data saved to: {output_csv}")
 
 
+def load_game_tracking(input_csv):
+    """
+    Load a game's tracking data sorted by match_time.
+
+    Args:
+        input_csv (str): Path to the {game_id}_pitch_plane_coordinates.csv file.
+
+    Returns:
+        tuple: (DataFrame sorted by match_time, match_time as a numpy array).
+    """
+    tracking_data = pd.read_csv(input_csv)
+    match_time = tracking_data["match_time"].to_numpy()
+    if not tracking_data["match_time"].is_monotonic_increasing:
+        # 安定ソートで同じmatch_timeの行は元の順序を保つ
+        order = np.argsort(match_time, kind="stable")
+        tracking_data = tracking_data.iloc[order].reset_index(drop=True)
+        match_time = match_time[order]
+    return tracking_data, match_time
+
+
 def parse_time_range(filename):
     match = re.search(r"(\d+)_\d{2}_\d{2}-\d{2}_\d{2}", filename)
     if match:
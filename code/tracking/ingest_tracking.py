@@ -0,0 +1,168 @@
+"""
+This script runs the whole tracking chain for a match in a single pass:
+raw XML/JSON tracking data -> pitch plane coordinates -> team_id and position
+-> per-clip {video}_tracking.csv files.
+
+It replaces running convert_raw_to_pitch_plane_csv.py, combine_pitch_plane_csv.py,
+add_team_id_to_pitch_plane_csv.py and get_tracking_in_video_from_pitch_plane_csv.py
+one after another. The raw data and metadata are read once, and rows are routed
+straight to the clips listed in videolist_{match_id}.txt. The full-match
+{match_id}_pitch_plane_coordinates.csv is not written.
+
+Usage:
+    python tracking/ingest_tracking.py --match_id <match_id>
+
+Example:
+    python tracking/ingest_tracking.py --match_id 117093,132831 --workers 2
+
+Arguments:
+    --match_id: Comma-separated match identifiers to process.
+    --xml_workers: Number of processes used to parse each XML file (default: 1).
+    --workers: Number of matches processed in parallel (default: 1).
+"""
+
+import argparse
+import os
+import pandas as pd
+from loguru import logger
+from convert_raw_to_pitch_plane_csv import iterparse_xml, iterparse_json, parse_xml_parallel
+from add_team_id_to_pitch_plane_csv import parse_xml_for_player_info, parse_json_for_player_info, build_lookup
+from get_tracking_in_video_from_pitch_plane_csv import parse_time_range
+from task_pool import run_tasks, report_failures
+
+
+OUTPUT_COLUMNS = ["frame", "match_time", "player_id", "x", "y", "team_id", "position"]
+
+
+def main():
+    """
+    Main function to parse arguments and run the fused ingest.
+    """
+    parser = argparse.ArgumentParser(description="Convert raw tracking data straight to per-clip tracking CSV files.")
+    parser.add_argument("--match_id", required=True, type=str, help="Comma-separated match identifiers to process.")
+    parser.add_argument("--xml_workers", type=int, default=1, help="Number of processes used to parse each XML file.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of matches processed in parallel.")
+    args = parser.parse_args()
+    match_ids = [str(match_id) for match_id in args.match_id.split(",")]
+
+    tasks = [(match_id, (match_id, args.xml_workers)) for match_id in match_ids]
+    report_failures(run_tasks(ingest_match, tasks, args.workers))
+
+
+def ingest_match(match_id, xml_workers=1):
+    """
+    Ingest the raw tracking data of one match into its per-clip tracking CSV files.
+
+    Args:
+        match_id (str): The match identifier.
+        xml_workers (int): Number of processes used to parse the XML file.
+    """
+    txt_file = f"raw/video/videolist_{match_id}.txt"
+    output_dir = f"raw/tracking/{match_id}"
+    clips = parse_video_list(txt_file, match_id)
+    if not clips:
+        logger.warning(f"No clips of match {match_id} found in {txt_file}")
+        return
+
+    if match_id == '132831' or match_id == '132877':
+        player_info = parse_json_for_player_info(f"raw/tracking/{match_id}/{match_id}_metadata.json")
+        chunks = (
+            chunk
+            for i in range(1, 4)
+            for chunk in iterparse_json(f"raw/tracking/{match_id}/{match_id}_{i}_frame_data.json")
+        )
+    else:
+        player_info = parse_xml_for_player_info(f"raw/tracking/{match_id}/{match_id}_tracker_box_metadata.xml")
+        input_xml = f"raw/tracking/{match_id}/{match_id}_tracker_box_data.xml"
+        if xml_workers > 1:
+            chunks = parse_xml_parallel(input_xml, xml_workers)
+        else:
+            chunks = iterparse_xml(input_xml)
+
+    write_clips(chunks, player_info, clips, output_dir)
+
+
+def parse_video_list(txt_file, match_id):
+    """
+    Read the clips of one match from a video list file.
+
+    Args:
+        txt_file (str): Path to videolist_{id}.txt.
+        match_id (str): Only clips of this match are kept.
+
+    Returns:
+        list of tuple: (video_file, start_ms, end_ms) for each clip, in file order.
+    """
+    with open(txt_file, "r") as f:
+        # 拡張子を省いたファイル名を取得
+        video_files = [os.path.splitext(line.strip())[0] for line in f.readlines()]
+
+    clips = []
+    for video_file in video_files:
+        game_id, start_time, end_time = parse_time_range(video_file)
+        if start_time is None or end_time is None:
+            continue
+        if game_id != match_id:
+            logger.warning(f"Skipping {video_file}: it does not belong to match {match_id}")
+            continue
+        clips.append((video_file, start_time * 1000, end_time * 1000))  # ミリ秒に変換
+    return clips
+
+
+def write_clips(chunks, player_info, clips, output_dir):
+    """
+    Attach team_id and position to tracking chunks and route the rows to per-clip files.
+
+    A row goes to every clip whose [start, end] range (inclusive, in ms) contains
+    its match_time, exactly as get_tracking_in_video_from_pitch_plane_csv.py
+    filters the full-match file. x and y keep the two decimals of the
+    pitch plane CSV.
+
+    Args:
+        chunks (iterable of dict): Column chunks as yielded by the convert parsers.
+        player_info (dict): Mapping of player_id to team_id and position.
+        clips (list of tuple): (video_file, start_ms, end_ms) for each clip.
+        output_dir (str): Directory of the {video_file}_tracking.csv outputs.
+    """
+    player_index = pd.Index(list(player_info))
+    team_lookup, team_categories = build_lookup([info["team_id"] for info in player_info.values()])
+    position_lookup, position_categories = build_lookup([info["position"] for info in player_info.values()])
+
+    outputs = [os.path.join(output_dir, f"{video_file}_tracking.csv") for video_file, _, _ in clips]
+    # Write to temporary files first so a failed ingest never leaves partial clips
+    files = [open(f"{output_csv}.tmp", "w", newline="") for output_csv in outputs]
+    try:
+        for f in files:
+            pd.DataFrame(columns=OUTPUT_COLUMNS).to_csv(f, index=False)
+
+        for chunk in chunks:
+            match_time = chunk["match_time"]
+            in_clip = [(match_time >= start) & (match_time <= end) for _, start, end in clips]
+            if not any(mask.any() for mask in in_clip):
+                continue
+
+            df = pd.DataFrame(chunk)
+            # Metadata keys are strings, as read back from the CSV by the separate stages
+            df["player_id"] = df["player_id"].where(df["player_id"].notna(), "").astype(str)
+            codes = player_index.get_indexer(df["player_id"])
+            df["team_id"] = pd.Categorical.from_codes(team_lookup[codes], categories=team_categories)
+            df["position"] = pd.Categorical.from_codes(position_lookup[codes], categories=position_categories)
+
+            for f, mask in zip(files, in_clip):
+                if mask.any():
+                    df[mask].to_csv(f, header=False, index=False, float_format="%.2f")
+
+        for f in files:
+            f.close()
+        for output_csv in outputs:
+            os.replace(f"{output_csv}.tmp", output_csv)
+            logger.info(f"Extracted tracking data saved to: {output_csv}")
+    finally:
+        for f, output_csv in zip(files, outputs):
+            f.close()
+            if os.path.exists(f"{output_csv}.tmp"):
+                os.remove(f"{output_csv}.tmp")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Helpers to run the independent per-match tasks of the tracking scripts either
+one after another or in a process pool.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+
+def run_tasks(func, tasks, workers=1):
+    """
+    Run func(*args) for every task, isolating failures so that one bad task does
+    not stop the others.
+
+    Tasks are submitted and their results collected in the given order, so the
+    log output is deterministic regardless of the number of workers.
+
+    Args:
+        func (callable): Module-level function to run for each task.
+        tasks (list of tuple): (name, args) pairs. name is used in log messages.
+        workers (int): Number of worker processes. 1 runs the tasks in this process.
+
+    Returns:
+        list of str: Names of the tasks that failed, in task order.
+    """
+    failed = []
+
+    if workers <= 1:
+        for name, args in tasks:
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Task {name} failed: {type(e).__name__}: {e}")
+                failed.append(name)
+        return failed
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(name, executor.submit(func, *args)) for name, args in tasks]
+        for name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Task {name} failed: {type(e).__name__}: {e}")
+                failed.append(name)
+
+    return failed
+
+
+def report_failures(failed):
+    """
+    Log the failed tasks and exit with a non-zero status if there are any.
+
+    Args:
+        failed (list of str): Names of the failed tasks, as returned by run_tasks.
+    """
+    if failed:
+        logger.error(f"{len(failed)} task(s) failed: {', '.join(failed)}")
+        raise SystemExit(1)